@@ -0,0 +1,53 @@
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from event_table import cache_dir_for, load_table, read_cache
+from map_jobs import MAP_JOBS
+from render_cache import DEFAULT_CACHE_DIR, cached_render
+
+
+# Worker: memory-map the shared columnar cache (nothing is pickled) and render one map.
+# With render_cache (a cache folder, see render_cache) an unchanged map is kept or copied instead.
+def render_map(cache_dir, name, output_folder, options, render_cache=None, json_path=None):
+    started = time.perf_counter()
+    module_name, function_name, output_file = MAP_JOBS[name]
+    generate = getattr(importlib.import_module(module_name), function_name)
+    if render_cache:
+        output_path, status = cached_render(generate, json_path, output_folder, output_file, render_cache, **options)
+        return output_path, time.perf_counter() - started, status
+    table = read_cache(cache_dir)
+    generate(table, output_folder=output_folder, output_file=output_file, **options)
+    return os.path.join(output_folder, output_file), time.perf_counter() - started, 'rendered'
+
+
+# Load merged_data once and render every requested map in parallel worker processes.
+# Each map is written atomically to its own file, so nothing in output_folder is deleted.
+# With render_cache set, maps whose data and options did not change are not rendered again.
+# Returns {name: (path, seconds, status)}, status being 'rendered', 'cached' or 'unchanged'.
+def render_all(json_path, output_folder='batch_output', maps=None, workers=None, render_cache=None, **options):
+    load_table(json_path)  # Build or refresh the cache once, before the workers map it
+    cache_dir = cache_dir_for(json_path)
+    maps = list(maps or MAP_JOBS)
+    os.makedirs(output_folder, exist_ok=True)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers or len(maps)) as executor:
+        futures = {
+            name: executor.submit(render_map, cache_dir, name, output_folder, options, render_cache, json_path)
+            for name in maps
+        }
+        for name, future in futures.items():
+            results[name] = future.result()
+    return results
+
+
+# Example Usage: python batch_render.py path/to/merged_data.json [output_folder]
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else 'heat_map\\merged_data.json'
+    output_folder = sys.argv[2] if len(sys.argv) > 2 else 'batch_output'
+    started = time.perf_counter()
+    for name, (path, seconds, status) in render_all(data_file, output_folder, render_cache=DEFAULT_CACHE_DIR).items():
+        print(f"{name}: {path} {status} ({seconds:.1f}s)")
+    print(f"All maps rendered in {time.perf_counter() - started:.1f}s")
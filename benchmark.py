@@ -0,0 +1,192 @@
+import argparse
+import importlib
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import folium
+from map_jobs import MAP_JOBS
+from event_table import cache_dir_for, load_table, read_cache
+from profiling import peak_rss_bytes, report_path_for
+from synthetic_data import synthetic_dataset
+
+# Dataset sizes (records) measured by default
+DEFAULT_SIZES = (10000, 100000, 1000000, 10000000)
+
+# Relative slowdown (or growth) of a metric that compare_results reports as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Metrics compared between runs
+COMPARED_METRICS = ('wall_time', 'peak_rss', 'html_bytes')
+
+
+# Child task: parse the JSON file and build its columnar cache from scratch
+def run_load(json_path):
+    started = time.perf_counter()
+    table = load_table(json_path, rebuild=True)
+    wall_time = time.perf_counter() - started
+    cache_dir = cache_dir_for(json_path)
+    return {
+        'records': len(table),
+        'cities': len(table.city_names),
+        'wall_time': wall_time,
+        'peak_rss': peak_rss_bytes(),
+        'json_bytes': os.path.getsize(json_path),
+        'cache_bytes': sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)),
+    }
+
+
+# Child task: render one map from the cached table with profiling on; the stages come from the
+# generator's profile report (see profiling), plus the time to map the cache
+def run_map(json_path, name, output_folder, options):
+    module_name, function_name, output_file = MAP_JOBS[name]
+    generate = getattr(importlib.import_module(module_name), function_name)
+
+    started = time.perf_counter()
+    table = read_cache(cache_dir_for(json_path))
+    read_time = time.perf_counter() - started
+    options = dict(_supported_options(generate, options), profile=options.get('profile') or True)
+    generate(table, output_folder=output_folder, output_file=output_file, **options)
+    output_path = os.path.join(output_folder, output_file)
+    with open(report_path_for(output_path), 'r') as file:
+        report = json.load(file)
+
+    stages = {'read_cache': read_time}
+    stages.update((entry['stage'], entry['seconds']) for entry in report['stages'] if '/' not in entry['stage'])
+    classify = [entry for entry in report['stages'] if entry['stage'] == 'classify']
+    return {
+        'map': name,
+        'records': len(table),
+        'rows': classify[0]['rows'] if classify else len(table),
+        'wall_time': read_time + report['total_seconds'],
+        'peak_rss': peak_rss_bytes(),
+        'html_bytes': os.path.getsize(output_path),
+        'stages': stages,
+    }
+
+
+# The options a generator accepts, so options of one map (e.g. bulk_markers) can be given to all
+def _supported_options(function, options):
+    parameters = inspect.signature(function).parameters
+    return {key: value for key, value in options.items() if key in parameters}
+
+
+# Run one task in a fresh interpreter, so every measurement has its own peak RSS and cold imports
+def _run_child(task):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', json.dumps(task)],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark task {task} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'folium': folium.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+# Generate (or reuse) a synthetic dataset per size, build its cache, then render every map from it.
+# Returns {'meta': ..., 'loads': [...], 'maps': [...]}, ready to be written as JSON.
+def run_benchmark(sizes=DEFAULT_SIZES, maps=None, data_folder='benchmark_data', output_folder='benchmark_output',
+                  options=None, seed=0, log=print):
+    maps = list(maps or MAP_JOBS)
+    options = options or {}
+    results = {'meta': dict(_environment(), seed=seed, options=options), 'loads': [], 'maps': []}
+    for size in sizes:
+        json_path = synthetic_dataset(data_folder, size, seed)
+        load = _run_child({'task': 'load', 'json_path': json_path})
+        results['loads'].append(load)
+        log(f"{size:>9} records  load        {load['wall_time']:8.2f}s  {_megabytes(load['peak_rss'])}")
+        for name in maps:
+            folder = os.path.join(output_folder, str(size))
+            run = _run_child({'task': 'map', 'json_path': json_path, 'name': name, 'output_folder': folder, 'options': options})
+            results['maps'].append(run)
+            stages = ' '.join(f"{stage}={seconds:.2f}" for stage, seconds in run['stages'].items())
+            log(f"{size:>9} records  {name:<15} {run['wall_time']:8.2f}s  {_megabytes(run['peak_rss'])}  "
+                f"{run['html_bytes'] / 1e6:8.1f}MB html  {stages}")
+    return results
+
+
+def _megabytes(size):
+    return '     n/a RSS' if size is None else f"{size / 1e6:8.1f}MB RSS"
+
+
+# Metrics of current that grew by more than tolerance relative to baseline, matched by (map, records)
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    baseline_runs = {(run['map'], run['records']): run for run in baseline['maps']}
+    for run in current['maps']:
+        before = baseline_runs.get((run['map'], run['records']))
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), run.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append({'map': run['map'], 'records': run['records'], 'metric': metric,
+                                    'baseline': old, 'current': new, 'ratio': new / old})
+    return regressions
+
+
+def _parse_option(text):
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every map generator on synthetic merged_data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--maps', nargs='+', choices=list(MAP_JOBS), default=list(MAP_JOBS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-folder', default='benchmark_data')
+    parser.add_argument('--output-folder', default='benchmark_output')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help="generator keyword argument, VALUE parsed as JSON (e.g. grid_size=0.1)")
+    parser.add_argument('--results', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="fail when a metric regressed against this run")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        task = json.loads(args.child)
+        if task['task'] == 'load':
+            result = run_load(task['json_path'])
+        else:
+            result = run_map(task['json_path'], task['name'], task['output_folder'], task['options'])
+        print(json.dumps(result))
+        return 0
+
+    options = dict(_parse_option(option) for option in args.option)
+    results = run_benchmark(args.sizes, args.maps, args.data_folder, args.output_folder, options, args.seed)
+    with open(args.results, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.results}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare_results(json.load(file), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['map']} @ {regression['records']}: {regression['metric']} "
+                  f"{regression['baseline']:.4g} -> {regression['current']:.4g} (x{regression['ratio']:.2f})")
+        return 1 if regressions else 0
+    return 0
+
+
+# Example Usage: python benchmark.py --sizes 10000 100000 --maps frequency temperature --option grid_size=0.1
+if __name__ == '__main__':
+    sys.exit(main())
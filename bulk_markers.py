@@ -0,0 +1,69 @@
+import json
+from folium.plugins import FastMarkerCluster
+from stream_html import StreamedArray
+
+# JS helpers shared by every row of a callback: HTML escaping and the AwesomeMarkers icon folium.Icon draws
+_CALLBACK_HELPERS = """
+function escapeHtml(value) {
+    return String(value === null ? 'None' : value).replace(/[&<>"']/g, function (c) {
+        return '&#' + c.charCodeAt(0) + ';';
+    });
+}
+var icons = {};
+function coloredIcon(color) {
+    if (!(color in icons)) {
+        icons[color] = L.AwesomeMarkers.icon({
+            markerColor: color, iconColor: 'white', icon: 'info-sign', prefix: 'glyphicon', extraClasses: 'fa-rotate-0'
+        });
+    }
+    return icons[color];
+}"""
+
+# Rows [lat, lon, city, first date, last date]: default marker, popup table built when opened
+CITY_TABLE_CALLBACK = """(function () {
+%s
+return function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(function () {
+        return "<table border='1'><tr><th>City</th><td>" + escapeHtml(row[2]) + "</td></tr>"
+            + "<tr><th>First Date</th><td>" + escapeHtml(row[3]) + "</td></tr>"
+            + "<tr><th>Last Date</th><td>" + escapeHtml(row[4]) + "</td></tr></table>";
+    }, {maxWidth: 300});
+    return marker;
+};
+})()""" % _CALLBACK_HELPERS
+
+
+# Marker cluster whose markers travel as one compact JSON array of rows ([lat, lon, *fields])
+# and are created in the browser by one shared JS callback, instead of a folium Marker, Icon and
+# Popup object per row. The callback builds each popup from its row only when it is opened.
+class BulkMarkerCluster(FastMarkerCluster):
+    def __init__(self, rows, callback, **kwargs):
+        super().__init__([], callback=callback, **kwargs)
+        self.data = rows  # Rows are already [lat, lon, ...]; skip the per-row validation of FastMarkerCluster
+
+
+# Marker rows from coordinate arrays and per-marker field lists, kept as columns and streamed into
+# the page when it is saved (see stream_html)
+def marker_rows(latitudes, longitudes, *fields):
+    return StreamedArray([latitudes, longitudes, *fields])
+
+
+# Callback for rows [lat, lon, city, condition]: condition indexes conditions/colors for the
+# special cities and is -1 for the rest, which get default_color and a city-only popup
+def special_city_callback(conditions, colors, default_color='white'):
+    return """(function () {
+%s
+var conditions = %s;
+var colors = %s;
+return function (row) {
+    var special = row[3] >= 0;
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.setIcon(coloredIcon(special ? colors[row[3]] : %s));
+    marker.bindPopup(function () {
+        var content = 'City: ' + escapeHtml(row[2]);
+        return special ? content + '<br>Condition: ' + escapeHtml(conditions[row[3]]) : content;
+    }, {maxWidth: 300});
+    return marker;
+};
+})()""" % (_CALLBACK_HELPERS, json.dumps(list(conditions)), json.dumps(list(colors)), json.dumps(default_color))
@@ -0,0 +1,152 @@
+import numpy as np
+
+# Per-city columns, in constructor order
+STAT_FIELDS = (
+    'codes',
+    'count',
+    'first_date',
+    'last_date',
+    'max_value',
+    'min_value',
+    'value_sum',
+    'latitude_sum',
+    'longitude_sum',
+    'first_row',
+    'marker_latitude',
+    'marker_longitude',
+)
+
+
+# Per-city aggregates, one entry per city ordered by the city's first event.
+# Every field can be merged with the same field of another CityStats, see merge_city_stats.
+class CityStats:
+    def __init__(self, codes, count, first_date, last_date, max_value, min_value, value_sum,
+                 latitude_sum, longitude_sum, first_row, marker_latitude, marker_longitude):
+        self.codes = codes  # City code (-1 groups the events without a city)
+        self.count = count
+        self.first_date = first_date
+        self.last_date = last_date
+        self.max_value = max_value
+        self.min_value = min_value
+        self.value_sum = value_sum
+        self.latitude_sum = latitude_sum
+        self.longitude_sum = longitude_sum
+        self.first_row = first_row  # Row of the city's first event, used to break ties
+        self.marker_latitude = marker_latitude  # Position of the city's first event
+        self.marker_longitude = marker_longitude
+
+    def __len__(self):
+        return len(self.codes)
+
+    def columns(self):
+        return {name: getattr(self, name) for name in STAT_FIELDS}
+
+    # Subset of the cities (index is a boolean mask or positions)
+    def take(self, index):
+        return CityStats(**{name: column[index] for name, column in self.columns().items()})
+
+    # Display names for every city, None for the group without a city
+    def names(self, city_names):
+        return [city_names[code] if code >= 0 else None for code in self.codes.tolist()]
+
+    def mean_value(self):
+        return self.value_sum / self.count
+
+    def mean_latitude(self):
+        return self.latitude_sum / self.count
+
+    def mean_longitude(self):
+        return self.longitude_sum / self.count
+
+
+# Group rows that describe (partial) city statistics by code and combine them.
+# Within a code the row with the smallest first_row wins the marker position.
+def _reduce_by_city(columns):
+    codes = columns['codes']
+    if len(codes) == 0:
+        return CityStats(**columns)
+    order = np.lexsort((columns['first_row'], codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_codes[1:] != sorted_codes[:-1])))
+    first = order[starts]
+
+    def reduce(ufunc, name):
+        return ufunc.reduceat(columns[name][order], starts)
+
+    reduced = CityStats(
+        codes=codes[first],
+        count=reduce(np.add, 'count'),
+        first_date=reduce(np.minimum, 'first_date'),
+        last_date=reduce(np.maximum, 'last_date'),
+        max_value=reduce(np.maximum, 'max_value'),
+        min_value=reduce(np.minimum, 'min_value'),
+        value_sum=reduce(np.add, 'value_sum'),
+        latitude_sum=reduce(np.add, 'latitude_sum'),
+        longitude_sum=reduce(np.add, 'longitude_sum'),
+        first_row=columns['first_row'][first],
+        marker_latitude=columns['marker_latitude'][first],
+        marker_longitude=columns['marker_longitude'][first],
+    )
+    # Order cities by first appearance so argmax/argmin break ties like max()/min() over a dict did
+    return reduced.take(np.argsort(reduced.first_row, kind='stable'))
+
+
+# Aggregate events per city in one vectorized pass: count, first/last date, max/min/sum of the
+# value, coordinate sums and the position of the first event. rows are the events' row numbers
+# in the whole dataset (defaults to their position) and decide which event comes first.
+def aggregate_by_city(city_codes, latitudes, longitudes, dates, values=None, rows=None):
+    city_codes = np.asarray(city_codes)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    dates = np.asarray(dates)
+    values = np.zeros(len(city_codes)) if values is None else np.asarray(values)
+    rows = np.arange(len(city_codes)) if rows is None else np.asarray(rows)
+
+    # Each event is a one-event city statistic; reducing them gives the per-city result
+    return _reduce_by_city({
+        'codes': city_codes,
+        'count': np.ones(len(city_codes), dtype=np.int64),
+        'first_date': dates,
+        'last_date': dates,
+        'max_value': values,
+        'min_value': values,
+        'value_sum': values.astype(np.float64),
+        'latitude_sum': latitudes,
+        'longitude_sum': longitudes,
+        'first_row': rows,
+        'marker_latitude': latitudes,
+        'marker_longitude': longitudes,
+    })
+
+
+# Merge partial statistics computed over disjoint sets of rows that share one city code space
+def merge_city_stats(*parts):
+    parts = [part for part in parts if part is not None]
+    columns = {name: np.concatenate([getattr(part, name) for part in parts]) for name in STAT_FIELDS}
+    return _reduce_by_city(columns)
+
+
+# Pick the highlighted cities as positions into stats; ties go to the city seen first
+def pick_special_cities(stats, value_label):
+    return {
+        "Most Frequent": int(np.argmax(stats.count)),
+        "Least Frequent": int(np.argmin(stats.count)),
+        f"Highest {value_label}": int(np.argmax(stats.max_value)),
+        f"Lowest {value_label}": int(np.argmin(stats.min_value)),
+        "Most Current Last Date": int(np.argmax(stats.last_date)),
+        "Least Current Last Date": int(np.argmin(stats.last_date)),
+        "Least Current First Date": int(np.argmin(stats.first_date)),
+    }
+
+
+# Positions of the k largest (or smallest) values, best first; ties go to the earlier position.
+# Only the cities tied with the k-th value are sorted, the rest is a linear partition.
+def top_k(values, k, largest=True):
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    keys = -values if largest else values
+    kth_key = np.partition(keys, k - 1)[k - 1]
+    candidates = np.flatnonzero(keys <= kth_key)
+    return candidates[np.lexsort((candidates, keys[candidates]))][:k]
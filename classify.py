@@ -0,0 +1,48 @@
+import numpy as np
+
+# Classes are ordered (label, lower, upper) tuples with inclusive bounds (None = unbounded).
+# The first matching class wins, like an if/elif chain. These are the default tables of the class
+# maps; a map's event_maps.CLASS_MAPS config can give its own classes or bin edges instead.
+MAGNITUDE_CLASSES = (
+    ('Low_Magnitude', None, 2),
+    ('Medium_Magnitude', 3, 5),
+    ('High_Magnitude', 5, None),
+)
+
+RAINFALL_CLASSES = (
+    ('Low_rainfall', None, 5),
+    ('Medium_rainfall', 6, 10),
+    ('High_rainfall', 10, None),
+)
+
+# Code given to values that fall between classes or are missing (NaN)
+NO_CLASS = -1
+
+
+# Position of a class label in a class table
+def class_code(classes, label):
+    for code, (name, _, _) in enumerate(classes):
+        if name == label:
+            return code
+    raise ValueError(f"Unknown class {label!r}")
+
+
+# Build classes from increasing bin edges: label i covers (edges[i - 1], edges[i]], the ends are open
+def classes_from_edges(edges, labels):
+    if len(labels) != len(edges) + 1:
+        raise ValueError("Need exactly one more label than bin edges")
+    return tuple(zip(labels, (None, *edges), (*edges, None)))
+
+
+# Classify a whole column at once, returning an int8 array of class codes (NO_CLASS when unmatched)
+def classify_array(values, classes):
+    values = np.asarray(values)
+    conditions = []
+    for _, lower, upper in classes:
+        condition = ~np.isnan(values)
+        if lower is not None:
+            condition &= values >= lower
+        if upper is not None:
+            condition &= values <= upper
+        conditions.append(condition)
+    return np.select(conditions, np.arange(len(classes), dtype=np.int8), default=NO_CLASS).astype(np.int8)
@@ -0,0 +1,162 @@
+import numpy as np
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.plugins import MarkerCluster
+from jinja2 import Template
+from profiling import stage
+from stream_html import StreamedArray
+
+# Cluster cell size in screen pixels, MarkerCluster's default maxClusterRadius
+CLUSTER_RADIUS = 80
+
+# Zoom levels that get clusters; zoomed in past MAX_CLUSTER_ZOOM every marker is drawn on its own
+MIN_CLUSTER_ZOOM = 0
+MAX_CLUSTER_ZOOM = 16
+
+# Web Mercator cannot show the poles, points beyond this latitude are clamped to it
+MAX_LATITUDE = 85.0511287798
+
+
+# Web Mercator pixel coordinates of each point at a zoom level (256 pixel tiles, origin top left)
+def pixel_xy(latitudes, longitudes, zoom):
+    size = 256.0 * (1 << zoom)
+    latitudes = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes) + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / np.pi) / 2.0 * size
+    return np.clip(x, 0, size - 1), np.clip(y, 0, size - 1)
+
+
+# Hierarchy of grid clusters, one level per zoom from max_zoom down to min_zoom. A cell at zoom z
+# is radius pixels wide, which is exactly 2x2 cells of zoom z + 1, so each level is built from the
+# one below it by halving the cell coordinates. Returns (clusters, alone_from): StreamedArray rows
+# [lat, lon, zoom, count, expansion] of every cluster with more than one point, lat/lon being the
+# mean of its points and expansion the zoom at which it first splits up, and per point the lowest
+# zoom from which it is drawn on its own (max_zoom + 1 for points without coordinates).
+def cluster_index(latitudes, longitudes, min_zoom=MIN_CLUSTER_ZOOM, max_zoom=MAX_CLUSTER_ZOOM, radius=CLUSTER_RADIUS):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    points = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+    x, y = pixel_xy(latitudes[points], longitudes[points], max_zoom)
+    cell_x = (x // radius).astype(np.int64)
+    cell_y = (y // radius).astype(np.int64)
+    stride = (256 << max_zoom) // radius + 2
+
+    # The points are the children of the first level; their expansion zoom is never read
+    count = np.ones(len(points), dtype=np.int64)
+    latitude_sum, longitude_sum = latitudes[points], longitudes[points]
+    expansion = np.full(len(points), max_zoom + 1, dtype=np.int64)
+    member = np.arange(len(points))  # Each point's cluster in the current level
+    alone = np.full(len(points), -1, dtype=np.int64)
+    levels = []
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        if zoom < max_zoom:
+            cell_x >>= 1
+            cell_y >>= 1
+        keys, first, parent = np.unique(cell_x * stride + cell_y, return_index=True, return_inverse=True)
+        size = len(keys)
+        children = np.bincount(parent, minlength=size)
+        count = np.bincount(parent, count, size).astype(np.int64)
+        latitude_sum = np.bincount(parent, latitude_sum, size)
+        longitude_sum = np.bincount(parent, longitude_sum, size)
+        expansion = np.where(children == 1, expansion[first], zoom + 1)
+        cell_x, cell_y = cell_x[first], cell_y[first]
+        member = parent[member]
+
+        # A point clustered at this zoom is clustered at every lower one too, so the first (highest)
+        # zoom it is clustered at is the one below where it is drawn on its own
+        multiple = count > 1
+        alone[(alone < 0) & multiple[member]] = zoom + 1
+        levels.append((latitude_sum[multiple] / count[multiple], longitude_sum[multiple] / count[multiple],
+                       np.full(int(multiple.sum()), zoom, dtype=np.int64), count[multiple], expansion[multiple]))
+
+    alone_from = np.full(len(latitudes), max_zoom + 1, dtype=np.int64)
+    alone_from[points] = np.where(alone < 0, min_zoom, alone)
+    return StreamedArray([np.concatenate(column) for column in zip(*levels)]), alone_from
+
+
+# Per-city markers clustered here instead of by MarkerCluster in the browser: the page holds the
+# marker rows ([lat, lon, *fields], see bulk_markers.marker_rows, plus a trailing alone_from column)
+# and the cluster_index levels, and on every move only draws the current zoom's clusters and single
+# markers in view. A single marker is created from its row by the same JS callback BulkMarkerCluster
+# uses, so its icon color and popup are unchanged; clicking a cluster zooms to where it splits up.
+# Markers sharing one location are never spread apart.
+class ClusteredMarkers(JSCSSMixin, MacroElement):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var rows = {{ this.rows|tojson }};
+            var clusters = {{ this.clusters|tojson }};
+            var makeMarker = {{ this.callback }};
+            var minZoom = {{ this.min_zoom }}, aloneColumn = {{ this.alone_column }};
+            var layer = L.layerGroup().addTo(map);
+            var levels = {}, markers = {}, shown = {};
+            clusters.forEach(function(cluster) {
+                (levels[cluster[2]] = levels[cluster[2]] || []).push(cluster);
+            });
+
+            // Markers are kept once built, so an open popup survives the redraw its panning causes
+            function pointMarker(index) {
+                if (!(index in markers)) {
+                    markers[index] = makeMarker(rows[index]);
+                }
+                return markers[index];
+            }
+            function clusterMarker(cluster) {
+                var count = cluster[3];
+                var size = count < 10 ? 'small' : count < 100 ? 'medium' : 'large';
+                var marker = L.marker(new L.LatLng(cluster[0], cluster[1]), {icon: L.divIcon({
+                    html: '<div><span>' + count + '</span></div>',
+                    className: 'marker-cluster marker-cluster-' + size,
+                    iconSize: new L.Point(40, 40)
+                })});
+                marker.on('click', function() { map.setView(marker.getLatLng(), cluster[4]); });
+                return marker;
+            }
+            function draw() {
+                var level = Math.max(Math.round(map.getZoom()), minZoom), current = levels[level] || [];
+                var bounds = map.getBounds().pad(0.5), next = {};
+                for (var i = 0; i < rows.length; i++) {
+                    if (rows[i][aloneColumn] <= level && bounds.contains([rows[i][0], rows[i][1]])) {
+                        next['p' + i] = i;
+                    }
+                }
+                for (var j = 0; j < current.length; j++) {
+                    if (bounds.contains([current[j][0], current[j][1]])) {
+                        next['c' + level + '_' + j] = current[j];
+                    }
+                }
+                for (var key in shown) {
+                    if (!(key in next)) {
+                        layer.removeLayer(shown[key]);
+                        delete shown[key];
+                    }
+                }
+                for (key in next) {
+                    if (!(key in shown)) {
+                        shown[key] = key.charAt(0) === 'p' ? pointMarker(next[key]) : clusterMarker(next[key]);
+                        layer.addLayer(shown[key]);
+                    }
+                }
+            }
+            map.on('moveend', draw);
+            draw();
+        })();
+        {% endmacro %}
+    """)
+
+    # Only the cluster icon styles: the clustering itself needs no leaflet.markercluster
+    default_css = MarkerCluster.default_css
+
+    def __init__(self, rows, callback, min_zoom=MIN_CLUSTER_ZOOM, max_zoom=MAX_CLUSTER_ZOOM, radius=CLUSTER_RADIUS):
+        super().__init__()
+        self._name = 'ClusteredMarkers'
+        self.callback = callback
+        self.min_zoom = min_zoom
+        with stage('cluster_index') as info:
+            self.clusters, alone_from = cluster_index(rows.columns[0], rows.columns[1], min_zoom, max_zoom, radius)
+            info['markers'] = len(rows)
+            info['clusters'] = len(self.clusters)
+        # The callbacks read fixed leading fields, so the extra column does not disturb them
+        self.rows = StreamedArray(rows.columns + [alone_from])
+        self.alone_column = len(rows.columns)
@@ -0,0 +1,97 @@
+import itertools
+import json
+
+# Fields the map generators actually read (dotted names reach into nested objects)
+MAP_FIELDS = (
+    'latitude',
+    'longitude',
+    'date',
+    'city',
+    'magnitude',
+    'weather.rain_sum',
+    'weather.temperature_mean',
+)
+
+# Number of characters read from the file per refill of the parse buffer
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+
+
+# Keep only the requested (possibly dotted) fields of a record, preserving nesting
+def project_record(record, fields):
+    projected = {}
+    for field in fields:
+        parts = field.split('.')
+        value = record
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+# Yield the elements of a top-level JSON array without loading the whole array
+def _iter_array(file, buffer, chunk_size):
+    pos = 1  # Skip the opening '['
+    eof = False
+    while True:
+        # Skip whitespace and separators between elements
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = file.read(chunk_size), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of file inside JSON array")
+        if buffer[pos] == ']':
+            return
+
+        try:
+            record, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The element is cut by the end of the buffer: drop consumed text and read more
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield record
+        pos = end
+
+
+# Yield one record per non-empty line of a newline-delimited JSON file
+def _iter_lines(file, buffer):
+    # The buffer may end mid-line, so complete it before handing over to the file iterator
+    head = (buffer + file.readline()).splitlines()
+    for line in itertools.chain(head, file):
+        if line.strip():
+            yield json.loads(line)
+
+
+# Stream records one at a time from a JSON array file or a newline-delimited JSON file
+def iter_records(file_path, fields=None, chunk_size=CHUNK_SIZE):
+    with open(file_path, 'r') as file:
+        # Find the first meaningful character to decide the file layout
+        buffer = file.read(chunk_size).lstrip()
+        while not buffer:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return  # Empty file
+            buffer = chunk.lstrip()
+
+        if buffer[0] == '[':
+            records = _iter_array(file, buffer, chunk_size)
+        else:
+            records = _iter_lines(file, buffer)
+
+        for record in records:
+            yield project_record(record, fields) if fields else record
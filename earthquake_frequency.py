@@ -1,69 +1,76 @@
 import os
-import shutil
-import json
 import folium
-from folium.plugins import HeatMap, MarkerCluster
-from collections import defaultdict
+from folium.plugins import MarkerCluster
+from data_loader import iter_records, MAP_FIELDS
+from event_table import days_to_dates
+from map_data import select_events
+from incremental_state import chunked_selection
+from map_layers import add_heat_layer, save_map
+from profiling import profiled, report_saved, stage
+from render_cache import cached_render
+from bulk_markers import BulkMarkerCluster, CITY_TABLE_CALLBACK, marker_rows
+from cluster_index import ClusteredMarkers
 
-def create_folder(folder_name):
-    if os.path.exists(folder_name):
-        shutil.rmtree(folder_name)  # Delete existing folder
-    os.makedirs(folder_name)  # Create a new folder
+def load_json(file_path, fields=MAP_FIELDS):
+    return iter_records(file_path, fields=fields)
 
-def load_json(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-def generate_heatmap(json_data, output_folder='output_data', output_file='heatmap.html'):
-    # Ensure output folder exists
-    create_folder(output_folder)
+@profiled('frequency')
+def generate_heatmap(json_data, output_folder='output_data', output_file='heatmap.html', grid_size=None, tile_zooms=None, region=None, period=None, bulk_markers=False, chunk_size=None, workers=None, precision=None, artifacts=None, kde=None, clustered_markers=False, profile=None):
+    # Ensure output folder exists (without wiping it, other maps may be writing there)
+    os.makedirs(output_folder, exist_ok=True)
     output_path = os.path.join(output_folder, output_file)
     
-    # Extract data
-    locations = [(entry['latitude'], entry['longitude']) for entry in json_data]
-    city_data = defaultdict(list)
-    
-    for entry in json_data:
-        city_name = entry.get('city')
-        if not city_name:
-            continue  # Skip entries without a city
-        if isinstance(city_name, list):  # Ensure city name is a string
-            city_name = ', '.join([str(c) for c in city_name if c])  # Convert list to string, skipping None values
-        city_data[city_name].append(entry)
+    # Aggregate every event per city (json_data can be an EventTable, records or an AggregateState)
+    # region limits the map to a (south, west, north, east) box or a (latitude, longitude, radius_km) circle
+    # chunk_size reads json_data (or a merged_data path) in batches of that many records, out of core;
+    # workers aggregates in that many processes
+    if chunk_size:
+        selection = chunked_selection(json_data, chunk_size, region=region)
+    else:
+        selection = select_events(json_data, region=region, workers=workers)
     
-    # Get first and last date for each city
-    city_markers = []
-    for city, entries in city_data.items():
-        lat, lon = entries[0]['latitude'], entries[0]['longitude']
-        dates = sorted(entry['date'] for entry in entries)
-        first_date, last_date = dates[0], dates[-1]
-        city_markers.append((lat, lon, city, first_date, last_date))
+    # Get first and last date for each city, skipping entries without a city
+    stats = selection.stats.take(selection.stats.codes >= 0)
+    city_names = stats.names(selection.city_names)
+    first_dates = days_to_dates(stats.first_date).tolist()
+    last_dates = days_to_dates(stats.last_date).tolist()
     
-    # Create map centered around mean location
-    avg_lat = sum(lat for lat, lon in locations) / len(locations)
-    avg_lon = sum(lon for lat, lon in locations) / len(locations)
-    m = folium.Map(location=[avg_lat, avg_lon], zoom_start=5)
+    # Build the map: heat layer, markers and legend (timed as one stage when profiling)
+    with stage('build_map'):
+        # Create map centered around mean location
+        m = folium.Map(location=selection.center, zoom_start=5)
     
-    # Add heatmap layer
-    HeatMap(locations).add_to(m)
+        # Add heatmap layer (binned when grid_size is set, pre-tiled when tile_zooms is set,
+        # one animation frame per day/week/month when period is set)
+        add_heat_layer(m, output_path, selection.latitudes, selection.longitudes, selection.weights, grid_size=grid_size, tile_zooms=tile_zooms,
+                       dates=selection.dates, period=period, kde=kde, counts=selection.counts)
     
-    # Add marker cluster for cities
-    marker_cluster = MarkerCluster().add_to(m)
-    for lat, lon, city, first_date, last_date in city_markers:
-        popup_content = f"<table border='1'><tr><th>City</th><td>{city}</td></tr>"
-        popup_content += f"<tr><th>First Date</th><td>{first_date}</td></tr>"
-        popup_content += f"<tr><th>Last Date</th><td>{last_date}</td></tr></table>"
-        folium.Marker(
-            [lat, lon],
-            popup=folium.Popup(popup_content, max_width=300)
-        ).add_to(marker_cluster)
+        # Add marker cluster for cities (with bulk_markers all cities go out as one data array
+        # and each popup table is only built in the browser when it is opened; clustered_markers
+        # also clusters them here, so the browser only draws the clusters in view)
+        if bulk_markers or clustered_markers:
+            rows = marker_rows(stats.marker_latitude, stats.marker_longitude, city_names, first_dates, last_dates)
+            (ClusteredMarkers if clustered_markers else BulkMarkerCluster)(rows, CITY_TABLE_CALLBACK).add_to(m)
+        else:
+            marker_cluster = MarkerCluster().add_to(m)
+            city_markers = zip(stats.marker_latitude.tolist(), stats.marker_longitude.tolist(), city_names, first_dates, last_dates)
+            for lat, lon, city, first_date, last_date in city_markers:
+                popup_content = f"<table border='1'><tr><th>City</th><td>{city}</td></tr>"
+                popup_content += f"<tr><th>First Date</th><td>{first_date}</td></tr>"
+                popup_content += f"<tr><th>Last Date</th><td>{last_date}</td></tr></table>"
+                folium.Marker(
+                    [lat, lon],
+                    popup=folium.Popup(popup_content, max_width=300)
+                ).add_to(marker_cluster)
     
-    # Save map
-    m.save(output_path)
-    print(f"Heatmap saved as {output_path}")
+    # Save map (precision rounds the streamed heat and marker coordinates to that many decimals;
+    # artifacts packages it for offline serving, see save_map)
+    save_map(m, output_path, precision, artifacts)
+    report_saved(f"Heatmap saved as {output_path}", output_path)
 
 # Example Usage
-data_file = 'heat_map\\merged_data.json'  # Ensure this JSON file exists
-create_folder('output_data')
-data = load_json(data_file)
-generate_heatmap(data)
+if __name__ == '__main__':
+    data_file = 'heat_map\\merged_data.json'  # Ensure this JSON file exists
+    # A rerun with the same data and options keeps the existing map (see render_cache)
+    output_path, status = cached_render(generate_heatmap, data_file)
+    print(f"{output_path}: {status}")
@@ -0,0 +1,328 @@
+import os
+import sys
+import numpy as np
+import folium
+from folium.plugins import MarkerCluster
+from bulk_markers import BulkMarkerCluster, marker_rows, special_city_callback
+from cluster_index import ClusteredMarkers
+from city_stats import pick_special_cities
+from classify import MAGNITUDE_CLASSES, RAINFALL_CLASSES, class_code, classes_from_edges
+from event_table import FLOAT_COLUMNS, as_table, load_table
+from incremental_state import aggregate_chunks, chunked_selection, map_config
+from map_data import require_events, select_classes, select_events
+from map_layers import add_heat_layer, save_map
+from profiling import profiled, report_saved, stage
+
+# One entry per class map: the value field (a column or its merged_data field), the classes
+# (or 'edges' and 'class_labels' for classes_from_edges) and the class to map, the label used in the
+# special-city conditions, marker colors per condition (default_color when a condition has none),
+# the color of the other cities' markers (None to leave them out), the legend and default output.
+CLASS_MAPS = {
+    'high_magnitude': {
+        'field': 'magnitude',
+        'classes': MAGNITUDE_CLASSES,
+        'label': 'High_Magnitude',
+        'value_label': 'Magnitude',
+        'colors': {
+            "Most Frequent": 'black',
+            "Least Frequent": 'red',
+            "Highest Magnitude": 'orange',
+            "Lowest Magnitude": 'green',
+            "Most Current Last Date": 'blue',
+            "Least Current Last Date": 'gray',
+            "Least Current First Date": 'purple',
+        },
+        'default_color': 'blue',
+        'other_cities_color': 'white',
+        'legend_height': 220,
+        'legend': [
+            ('black', 'Most Frequent'),
+            ('red', 'Least Frequent'),
+            ('orange', 'Highest Magnitude'),
+            ('green', 'Lowest Magnitude'),
+            ('blue', 'Most Current Last Date'),
+            ('gray', 'Least Current Last Date'),
+            ('purple', 'Least Current First Date'),
+            ('white', 'Other Cities'),
+        ],
+        'output_folder': 'output_data1',
+        'output_file': 'heat22map.html',
+    },
+    'low_magnitude': {
+        'field': 'magnitude',
+        'classes': MAGNITUDE_CLASSES,
+        'label': 'Low_Magnitude',
+        'value_label': 'Magnitude',
+        'colors': {
+            "Most Frequent": 'black',
+            "Least Frequent": 'red',
+            "Highest Magnitude": 'orange',
+            "Lowest Magnitude": 'green',
+            "Most Current Last Date": 'gray',
+            "Least Current Last Date": 'blue',
+            "Least Current First Date": 'purple',
+        },
+        'default_color': 'white',
+        'other_cities_color': None,
+        'legend_height': 230,
+        'legend': [
+            ('black', 'Most Frequent'),
+            ('red', 'Least Frequent'),
+            ('orange', 'Highest Magnitude'),
+            ('green', 'Lowest Magnitude'),
+            ('gray', 'Most Current Last Date'),
+            ('blue', 'Least Current Last Date'),
+            ('purple', 'Least Current First Date'),
+            ('white', 'Other Cities'),
+        ],
+        'output_folder': 'output_data1',
+        'output_file': 'heatmap_low_mag.html',
+    },
+    'high_rainfall': {
+        'field': 'weather.rain_sum',
+        'classes': RAINFALL_CLASSES,
+        'label': 'High_rainfall',
+        'value_label': 'Rainfall',
+        'colors': {
+            "Most Frequent": 'black',
+            "Least Frequent": 'red',
+            "Highest Rainfall": 'orange',
+            "Lowest Rainfall": 'green',
+            "Most Current Last Date": 'blue',
+            "Least Current Last Date": 'gray',
+            "Least Current First Date": 'purple',
+        },
+        'default_color': 'blue',
+        'other_cities_color': None,
+        'legend_height': 220,
+        'legend': [
+            ('black', 'Most Frequent'),
+            ('red', 'Least Frequent'),
+            ('orange', 'Highest rainfall'),
+            ('green', 'Lowest rainfall'),
+            ('blue', 'Most Current Last Date'),
+            ('gray', 'Least Current Last Date'),
+            ('purple', 'Least Current First Date'),
+        ],
+        'output_folder': 'rainfall_folder',
+        'output_file': 'rainfall_heatmap.html',
+    },
+    'low_rainfall': {
+        'field': 'weather.rain_sum',
+        'classes': RAINFALL_CLASSES,
+        'label': 'Low_rainfall',
+        'value_label': 'rainfall',
+        'colors': {
+            "Most Frequent": 'black',
+            "Least Frequent": 'red',
+            "Highest rainfall": 'orange',
+            "Lowest rainfall": 'green',
+            "Most Current Last Date": 'gray',
+            "Least Current Last Date": 'blue',
+            "Least Current First Date": 'purple',
+        },
+        'default_color': 'white',
+        'other_cities_color': None,
+        'legend_height': 220,
+        'legend': [
+            ('black', 'Most Frequent'),
+            ('red', 'Least Frequent'),
+            ('orange', 'Highest rainfall'),
+            ('green', 'Lowest rainfall'),
+            ('blue', 'Most Current Last Date'),
+            ('gray', 'Least Current Last Date'),
+            ('purple', 'Least Current First Date'),
+        ],
+        'output_folder': 'rainfolder_2',
+        'output_file': 'lowrainfall_heatmap_low_mag.html',
+    },
+}
+
+
+# Table column holding a config's value field ('weather.rain_sum' -> 'rain_sum')
+def value_column_for(field):
+    if field in FLOAT_COLUMNS:
+        return field
+    for column, (source_field, _, _) in FLOAT_COLUMNS.items():
+        if source_field == field:
+            return column
+    raise ValueError(f"No column holds the field {field!r}")
+
+
+# Class table of a config, given directly or as bin edges with one label per bin
+def classes_for(config):
+    if 'classes' in config:
+        return tuple(tuple(c) for c in config['classes'])
+    return classes_from_edges(config['edges'], config['class_labels'])
+
+
+# What a map selects: (value column, classes, class label, weighted); label picks another class
+# of a class map's value field (e.g. Medium_Magnitude), the other maps have no classes to pick
+def map_query(name, label=None):
+    if name in ('frequency', 'temperature'):
+        if label is not None:
+            raise ValueError(f"The {name} map has no classes")
+        return (None, None, None, False) if name == 'frequency' else ('temperature_mean', None, None, True)
+    config = CLASS_MAPS[name]
+    classes = classes_for(config)
+    if label is not None:
+        class_code(classes, label)  # Unknown labels are an error
+    return value_column_for(config['field']), classes, label or config['label'], False
+
+
+# The fixed legend box of a class map
+def add_class_legend(map_obj, config):
+    entries = ''.join(
+        f'        <i style="background-color: {color}; width: 20px; height: 20px; display: inline-block;"></i> {text}<br>\n'
+        for color, text in config['legend']
+    )
+    legend_html = f'''
+    <div style="position: fixed; bottom: 30px; left: 30px; width: 180px; height: {config['legend_height']}px; background-color: rgba(255, 255, 255, 0.7); z-index:9999; border-radius: 10px; padding: 10px; font-size: 12px;">
+        <b>Legend:</b><br>
+{entries}    </div>
+    '''
+    map_obj.get_root().html.add_child(folium.Element(legend_html))
+
+
+# Add the special-city markers (and the other cities' markers when the config draws them)
+def _add_city_markers(map_obj, config, stats, city_names, bulk_markers, clustered_markers=False):
+    special_city_indices = pick_special_cities(stats, config['value_label'])
+    colors = config['colors']
+    default_color = config['default_color']
+    other_color = config['other_cities_color']
+    marker_latitudes = stats.marker_latitude.tolist()  # Each city's marker sits on its first event
+    marker_longitudes = stats.marker_longitude.tolist()
+
+    # With bulk_markers every marker goes out as one data array, one row per special condition
+    # plus one per other city, and popups are built on click; clustered_markers also clusters
+    # them here (see cluster_index) instead of in the browser
+    if bulk_markers or clustered_markers:
+        conditions = list(special_city_indices)
+        indices = list(special_city_indices.values())
+        positions = list(range(len(indices)))
+        if other_color is not None:
+            others = np.ones(len(city_names), dtype=bool)
+            others[indices] = False
+            other_indices = np.flatnonzero(others).tolist()
+            indices += other_indices
+            positions += [-1] * len(other_indices)
+        rows = marker_rows(
+            stats.marker_latitude[indices],
+            stats.marker_longitude[indices],
+            [city_names[index] for index in indices],
+            positions,
+        )
+        callback = special_city_callback(conditions, [colors.get(c, default_color) for c in conditions], other_color or default_color)
+        (ClusteredMarkers if clustered_markers else BulkMarkerCluster)(rows, callback).add_to(map_obj)
+        return
+
+    marker_cluster = MarkerCluster().add_to(map_obj)
+    for condition, index in special_city_indices.items():
+        folium.Marker(
+            [marker_latitudes[index], marker_longitudes[index]],
+            popup=folium.Popup(f"City: {city_names[index]}<br>Condition: {condition}", max_width=300),
+            icon=folium.Icon(color=colors.get(condition, default_color))
+        ).add_to(marker_cluster)
+
+    if other_color is not None:
+        special_indices = set(special_city_indices.values())
+        for index, city in enumerate(city_names):
+            if index not in special_indices:
+                folium.Marker(
+                    [marker_latitudes[index], marker_longitudes[index]],
+                    popup=folium.Popup(f"City: {city}", max_width=300),
+                    icon=folium.Icon(color=other_color)
+                ).add_to(marker_cluster)
+
+
+# Draw and save one class map from its selection (precision, artifacts: see save_map; kde: see add_heat_layer;
+# clustered_markers: see cluster_index)
+def render_class_map(selection, config, output_path, grid_size=None, tile_zooms=None, period=None, bulk_markers=False, precision=None,
+                     artifacts=None, kde=None, clustered_markers=False):
+    stats = selection.stats
+    city_names = stats.names(selection.city_names)
+    with stage('build_map'):
+        m = folium.Map(location=selection.center, zoom_start=5)
+        add_heat_layer(m, output_path, selection.latitudes, selection.longitudes, selection.weights, grid_size=grid_size, tile_zooms=tile_zooms,
+                       dates=selection.dates, period=period, kde=kde, kde_title=f"{config['label'].replace('_', ' ')} density",
+                       counts=selection.counts)
+        _add_city_markers(m, config, stats, city_names, bulk_markers, clustered_markers)
+        add_class_legend(m, config)
+    save_map(m, output_path, precision, artifacts)
+
+
+# Generate one class map (see CLASS_MAPS). json_data can be an EventTable, records or an
+# AggregateState built for this map's class; region limits it to a (south, west, north, east) box
+# or a (latitude, longitude, radius_km) circle. chunk_size aggregates json_data (or a merged_data
+# path) out of core, in batches of that many records; workers aggregates in that many processes.
+# label maps another class of the config's value field (e.g. Medium_Magnitude) with its colors and legend.
+def generate_class_map(json_data, name, output_folder=None, output_file=None, grid_size=None, tile_zooms=None, region=None,
+                       period=None, bulk_markers=False, chunk_size=None, workers=None, precision=None, artifacts=None, kde=None,
+                       clustered_markers=False, label=None):
+    config = CLASS_MAPS[name]
+    if label is not None:
+        map_query(name, label)
+        config = dict(config, label=label)
+    output_folder = output_folder or config['output_folder']
+    os.makedirs(output_folder, exist_ok=True)
+    output_path = os.path.join(output_folder, output_file or config['output_file'])
+    query = (value_column_for(config['field']), classes_for(config), config['label'])
+    if chunk_size:
+        selection = chunked_selection(json_data, chunk_size, *query, region=region)
+    else:
+        selection = select_events(json_data, *query, region=region, workers=workers)
+    render_class_map(selection, config, output_path, grid_size, tile_zooms, period, bulk_markers, precision, artifacts, kde,
+                     clustered_markers)
+    return output_path
+
+
+# Generate several class maps with one classification pass per value field: maps sharing a field
+# and class table (high+low magnitude, high+low rainfall) are classified and aggregated together.
+# output_folder puts every map in one folder instead of each config's own. With chunk_size every
+# map's aggregates are built in one batched, out-of-core read of json_data. Returns {name: path}.
+@profiled('class_maps')
+def generate_class_maps(json_data, names=None, output_folder=None, grid_size=None, tile_zooms=None, region=None,
+                        period=None, bulk_markers=False, chunk_size=None, workers=None, precision=None, artifacts=None,
+                        kde=None, clustered_markers=False, profile=None):
+    names = list(names or CLASS_MAPS)
+    groups = {}
+    for name in names:
+        config = CLASS_MAPS[name]
+        groups.setdefault((value_column_for(config['field']), classes_for(config)), []).append(name)
+
+    # Records are read once for all groups; a pre-aggregated state only holds its own map's class
+    states = {}
+    if chunk_size:
+        configs = {CLASS_MAPS[name]['label']: map_config(value_column, classes, CLASS_MAPS[name]['label'])
+                   for (value_column, classes), group in groups.items() for name in group}
+        states = dict(zip(configs, aggregate_chunks(json_data, list(configs.values()), chunk_size, region)))
+        for label, state in states.items():
+            require_events(state.cells, label, region)
+        region = None  # Applied batch by batch
+    data = json_data if chunk_size or hasattr(json_data, 'selection') else as_table(json_data)
+    paths = {}
+    for (value_column, classes), group in groups.items():
+        labels = [CLASS_MAPS[name]['label'] for name in group]
+        if states:
+            selections = {label: select_events(states[label], value_column, classes, label) for label in labels}
+        elif hasattr(data, 'selection'):
+            selections = {label: select_events(data, value_column, classes, label, region=region) for label in labels}
+        else:
+            selections = select_classes(data, value_column, classes, labels, region=region, workers=workers)
+        for name in group:
+            config = CLASS_MAPS[name]
+            folder = output_folder or config['output_folder']
+            os.makedirs(folder, exist_ok=True)
+            paths[name] = os.path.join(folder, config['output_file'])
+            render_class_map(selections[config['label']], config, paths[name], grid_size, tile_zooms, period, bulk_markers, precision,
+                             artifacts, kde, clustered_markers)
+
+    report_saved(f"{len(paths)} class maps saved: {', '.join(paths.values())}",
+                 os.path.join(output_folder or CLASS_MAPS[names[0]]['output_folder'], 'class_maps'))
+    return paths
+
+
+# Example Usage: python event_maps.py path/to/merged_data.json [map ...]
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else 'heat_map\\merged_data.json'
+    generate_class_maps(load_table(data_file), sys.argv[2:] or None)
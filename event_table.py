@@ -0,0 +1,246 @@
+import json
+import os
+import sys
+from array import array
+import numpy as np
+from data_loader import iter_records, MAP_FIELDS
+
+# Bump whenever the on-disk layout or the normalisation rules change
+CACHE_VERSION = 3
+
+# Column name -> (source field, dtype, value used when the field is missing)
+FLOAT_COLUMNS = {
+    'latitude': ('latitude', np.float64, np.nan),
+    'longitude': ('longitude', np.float64, np.nan),
+    'magnitude': ('magnitude', np.float64, np.nan),
+    'rain_sum': ('weather.rain_sum', np.float64, 0.0),  # The rainfall scripts treat a missing rain_sum as 0
+    'temperature_mean': ('weather.temperature_mean', np.float64, np.nan),
+}
+
+# Number of rows converted back to records at a time by EventTable.iter_records
+RECORD_BLOCK = 65536
+
+# Number of date strings build_table holds before parsing them into day numbers
+DATE_BLOCK = 65536
+
+
+# Turn a raw city value into the display string used on the maps (None when missing)
+def normalize_city(city_name):
+    if isinstance(city_name, (list, tuple)):
+        city_name = ', '.join([str(c) for c in city_name if c])  # Join list elements, skipping None values
+    return city_name or None
+
+
+# Interned cities of a dataset: each raw city value (a string, or a list given as a tuple) maps to a
+# small int code, normalised once on first sight; values with the same display name share a code.
+# Every city keeps a representative position, the one of the event it was first seen with.
+class CityDictionary:
+    def __init__(self, names=(), latitudes=None, longitudes=None):
+        self.names = list(names)
+        self.latitude = array('d', [np.nan] * len(self.names) if latitudes is None else latitudes)
+        self.longitude = array('d', [np.nan] * len(self.names) if longitudes is None else longitudes)
+        self._name_codes = {name: code for code, name in enumerate(self.names)}
+        self._raw_codes = dict(self._name_codes)
+        self._raw_codes[None] = -1
+
+    def __len__(self):
+        return len(self.names)
+
+    # Code of a raw city value (-1 when missing), registering a new city at the given position
+    def code(self, raw, latitude=np.nan, longitude=np.nan):
+        key = tuple(raw) if isinstance(raw, list) else raw
+        code = self._raw_codes.get(key)
+        if code is None:
+            name = normalize_city(raw)
+            code = -1 if name is None else self._name_codes.get(name)
+            if code is None:
+                code = self._name_codes[name] = len(self.names)
+                self.names.append(name)
+                self.latitude.append(latitude)
+                self.longitude.append(longitude)
+            self._raw_codes[key] = code
+        return code
+
+    # Display name of a code, None for -1
+    def name(self, code):
+        return self.names[code] if code >= 0 else None
+
+
+# Convert ISO 'YYYY-MM-DD' strings to int32 day numbers since 1970-01-01. Only the first ten
+# characters are kept (a trailing time is ignored) and the fixed-width bytes go straight to
+# NumPy's datetime64 parser, so no datetime objects or strptime calls are made.
+def dates_to_days(dates):
+    raw = np.asarray(dates, dtype='S10')
+    if raw.size == 0:
+        return np.empty(0, dtype=np.int32)
+    return raw.astype('datetime64[D]').astype(np.int32)
+
+
+# Convert day numbers since 1970-01-01 back to ISO 'YYYY-MM-DD' strings
+def days_to_dates(days):
+    return np.datetime_as_string(np.asarray(days).astype('datetime64[D]'), unit='D')
+
+
+# Read a dotted field from a record, returning default when any level is missing or null
+def _get_field(record, field, default):
+    value = record
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return default
+        value = value.get(part)
+    return default if value is None else value
+
+
+# Column-oriented view of merged_data: one NumPy array per field, cities dictionary-encoded.
+# city_names is a CityDictionary or the list of names the codes index.
+class EventTable:
+    def __init__(self, columns, city_names):
+        self.latitude = columns['latitude']
+        self.longitude = columns['longitude']
+        self.magnitude = columns['magnitude']
+        self.rain_sum = columns['rain_sum']
+        self.temperature_mean = columns['temperature_mean']
+        self.date = columns['date']  # int32 days since 1970-01-01
+        self.city = columns['city']  # int32 index into city_names, -1 when missing
+        self.cities = city_names if isinstance(city_names, CityDictionary) else CityDictionary(city_names)
+        self.city_names = self.cities.names
+        self.cache_dir = None  # Set when the columns are memory-mapped from a cache (see read_cache)
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def columns(self):
+        return {name: getattr(self, name) for name in (*FLOAT_COLUMNS, 'date', 'city')}
+
+    # Subset of the rows (index is a boolean mask or positions) sharing this table's city codes
+    def take(self, index):
+        return EventTable({name: column[index] for name, column in self.columns().items()}, self.cities)
+
+    # Yield rows as records shaped like the projected JSON, for code that still reads dicts
+    def iter_records(self):
+        for start in range(0, len(self), RECORD_BLOCK):
+            block = slice(start, start + RECORD_BLOCK)
+            latitudes = self.latitude[block].tolist()
+            longitudes = self.longitude[block].tolist()
+            magnitudes = self.magnitude[block].tolist()
+            rain_sums = self.rain_sum[block].tolist()
+            temperatures = self.temperature_mean[block].tolist()
+            dates = days_to_dates(self.date[block]).tolist()
+            cities = [self.city_names[code] if code >= 0 else None for code in self.city[block].tolist()]
+            for row in zip(latitudes, longitudes, dates, cities, magnitudes, rain_sums, temperatures):
+                yield {
+                    'latitude': row[0],
+                    'longitude': row[1],
+                    'date': row[2],
+                    'city': row[3],
+                    'magnitude': row[4],
+                    'weather': {'rain_sum': row[5], 'temperature_mean': row[6]},
+                }
+
+
+# Return data as an EventTable, building one from an iterable of records when needed
+def as_table(data):
+    if isinstance(data, EventTable):
+        return data
+    return build_table(data)
+
+
+# Build an EventTable from an iterable of records in one pass, without keeping the records
+def build_table(records):
+    values = {name: array('d') for name in FLOAT_COLUMNS}
+    days = array('i')
+    pending_dates = []
+    cities = array('i')
+    city_dictionary = CityDictionary()
+    latitudes = values['latitude']
+    longitudes = values['longitude']
+
+    for record in records:
+        for name, (field, _, default) in FLOAT_COLUMNS.items():
+            values[name].append(_get_field(record, field, default))
+        pending_dates.append(record['date'])
+        if len(pending_dates) == DATE_BLOCK:
+            days.frombytes(dates_to_days(pending_dates).tobytes())
+            pending_dates = []
+        cities.append(city_dictionary.code(record.get('city'), latitudes[-1], longitudes[-1]))
+
+    days.frombytes(dates_to_days(pending_dates).tobytes())
+
+    columns = {
+        name: np.frombuffer(values[name], dtype=np.float64).astype(dtype)
+        for name, (_, dtype, _) in FLOAT_COLUMNS.items()
+    }
+    columns['date'] = np.frombuffer(days, dtype=np.int32).copy()
+    columns['city'] = np.frombuffer(cities, dtype=np.int32).copy()
+    return EventTable(columns, city_dictionary)
+
+
+# Default cache location: a directory next to the source file
+def cache_dir_for(json_path):
+    return json_path + '.cache'
+
+
+def _source_fingerprint(json_path):
+    stat = os.stat(json_path)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Write every column as .npy plus a meta.json that marks the cache as complete
+def write_cache(table, cache_dir, fingerprint):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # Invalidate first so a crash mid-write never looks like a valid cache
+
+    for name, column in table.columns().items():
+        np.save(os.path.join(cache_dir, name + '.npy'), column)
+    np.save(os.path.join(cache_dir, 'city_latitude.npy'), np.frombuffer(table.cities.latitude, dtype=np.float64))
+    np.save(os.path.join(cache_dir, 'city_longitude.npy'), np.frombuffer(table.cities.longitude, dtype=np.float64))
+
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({**fingerprint, 'rows': len(table), 'city_names': table.city_names}, file)
+    os.replace(tmp_path, meta_path)
+
+
+# Memory-map a cache written by write_cache, or return None if it is missing or stale
+def read_cache(cache_dir, fingerprint=None):
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    if fingerprint is not None and any(meta.get(key) != value for key, value in fingerprint.items()):
+        return None
+
+    columns = {
+        name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+        for name in (*FLOAT_COLUMNS, 'date', 'city')
+    }
+    cities = CityDictionary(
+        meta['city_names'],
+        np.load(os.path.join(cache_dir, 'city_latitude.npy')),
+        np.load(os.path.join(cache_dir, 'city_longitude.npy')),
+    )
+    table = EventTable(columns, cities)
+    table.cache_dir = cache_dir
+    return table
+
+
+# Load merged_data as an EventTable, rebuilding the columnar cache when the source changed
+def load_table(json_path, cache_dir=None, rebuild=False):
+    cache_dir = cache_dir or cache_dir_for(json_path)
+    fingerprint = _source_fingerprint(json_path)
+    table = None if rebuild else read_cache(cache_dir, fingerprint)
+    if table is None:
+        write_cache(build_table(iter_records(json_path, fields=MAP_FIELDS)), cache_dir, fingerprint)
+        table = read_cache(cache_dir, fingerprint)
+    return table
+
+
+# One-time conversion: python event_table.py path/to/merged_data.json [cache_dir]
+if __name__ == '__main__':
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+    table = load_table(source, target, rebuild=True)
+    print(f"Cached {len(table)} records from {source} in {target or cache_dir_for(source)}")
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+
+
+def _cell_sizes(cell_size):
+    return cell_size if isinstance(cell_size, tuple) else (cell_size, cell_size)
+
+
+# Per-cell heat totals on a lat/lon grid: point count, coordinate sums and weight sum.
+# Totals for disjoint sets of points on the same grid can be merged.
+class HeatCells:
+    def __init__(self, cell_size, cells, count, latitude_sum, longitude_sum, weight_sum):
+        self.cell_size = cell_size
+        self.cells = cells  # Cell id: row * columns + column, sorted
+        self.count = count
+        self.latitude_sum = latitude_sum
+        self.longitude_sum = longitude_sum
+        self.weight_sum = weight_sum  # Equal to count when the points were unweighted
+
+    def __len__(self):
+        return len(self.cells)
+
+    def columns(self):
+        return {
+            'cells': self.cells,
+            'count': self.count,
+            'latitude_sum': self.latitude_sum,
+            'longitude_sum': self.longitude_sum,
+            'weight_sum': self.weight_sum,
+        }
+
+    # Sum the totals of rows that share a cell id
+    @classmethod
+    def _reduce(cls, cell_size, cells, count, latitude_sum, longitude_sum, weight_sum):
+        unique_cells, cell_index = np.unique(cells, return_inverse=True)
+        return cls(
+            cell_size,
+            unique_cells,
+            np.bincount(cell_index, weights=count).astype(np.int64),
+            np.bincount(cell_index, weights=latitude_sum),
+            np.bincount(cell_index, weights=longitude_sum),
+            np.bincount(cell_index, weights=weight_sum),
+        )
+
+    # cell_size is in degrees, either one value or a (lat, lon) pair
+    @classmethod
+    def from_points(cls, latitudes, longitudes, weights=None, cell_size=0.1):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        lat_size, lon_size = _cell_sizes(cell_size)
+        rows = np.floor((latitudes + 90.0) / lat_size).astype(np.int64)
+        cols = np.floor((longitudes + 180.0) / lon_size).astype(np.int64)
+        cells = rows * (math.ceil(360.0 / lon_size) + 1) + cols
+        count = np.ones(len(cells))
+        weights = count if weights is None else np.asarray(weights, dtype=np.float64)
+        return cls._reduce(cell_size, cells, count, latitudes, longitudes, weights)
+
+    def merge(self, other):
+        if _cell_sizes(self.cell_size) != _cell_sizes(other.cell_size):
+            raise ValueError("Cannot merge heat cells built on different grids")
+        columns = {name: np.concatenate((column, other.columns()[name])) for name, column in self.columns().items()}
+        return HeatCells._reduce(self.cell_size, **columns)
+
+    # One point per cell at the cell's centroid, with its weight sum (or point count)
+    def points(self, weighted=True):
+        weights = self.weight_sum if weighted else self.count.astype(np.float64)
+        return self.latitude_sum / self.count, self.longitude_sum / self.count, weights
+
+
+# Snap points to a lat/lon grid and return one point per occupied cell: the cell's centroid
+# and the summed weight (the number of points when no weights are given).
+# cell_size is in degrees, either one value or a (lat, lon) pair.
+def bin_points(latitudes, longitudes, weights=None, cell_size=0.1):
+    return HeatCells.from_points(latitudes, longitudes, weights, cell_size).points()
+
+
+# Point list for folium's HeatMap, pre-aggregated on a grid when grid_size is set
+def heat_points(latitudes, longitudes, weights=None, grid_size=None):
+    if grid_size is not None:
+        latitudes, longitudes, weights = bin_points(latitudes, longitudes, weights, grid_size)
+    columns = [latitudes, longitudes] if weights is None else [latitudes, longitudes, weights]
+    return np.column_stack(columns).tolist()
@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.plugins import HeatMap
+from jinja2 import Template
+from grid_binning import bin_points
+
+# Binning cells per tile side: fine enough that the heat radius hides the grid
+CELLS_PER_TILE = 64
+
+# Decimal places kept for tile coordinates
+TILE_PRECISION = 5
+
+# Web Mercator cannot show the poles, tiles stop at this latitude
+MAX_LATITUDE = 85.0511287798
+
+
+# Slippy-map tile column and row of each point at a zoom level
+def tile_xy(latitudes, longitudes, zoom):
+    n = 1 << zoom
+    latitudes = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(longitudes) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+# Bin the points for one zoom level and write one compact JSON file per occupied tile
+def write_zoom_level(latitudes, longitudes, weights, tiles_dir, zoom):
+    cell_size = 360.0 / (1 << zoom) / CELLS_PER_TILE
+    latitudes, longitudes, weights = bin_points(latitudes, longitudes, weights, cell_size)
+    x, y = tile_xy(latitudes, longitudes, zoom)
+
+    # Sort the cells by tile so each tile is one contiguous slice
+    tile_keys = x * (1 << zoom) + y
+    order = np.argsort(tile_keys, kind='stable')
+    points = np.column_stack((latitudes, longitudes, weights))[order].round(TILE_PRECISION)
+    tile_keys = tile_keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], tile_keys[1:] != tile_keys[:-1])))
+    ends = np.append(starts[1:], len(tile_keys))
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        tile_x, tile_y = int(x[order[start]]), int(y[order[start]])
+        folder = os.path.join(tiles_dir, str(zoom), str(tile_x))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'{tile_y}.json'), 'w') as file:
+            json.dump(points[start:end].tolist(), file, separators=(',', ':'))
+    return zoom, len(starts), float(weights.max()) if len(weights) else 0.0
+
+
+# Put a completely written folder in place of target, dropping everything target held before
+def replace_folder(source, target):
+    old_dir = f'{target}.{os.getpid()}.old'
+    if os.path.isdir(target):
+        os.replace(target, old_dir)
+    os.replace(source, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+# Write a pyramid of pre-aggregated heat tiles (z/x/y.json), one zoom level per worker process.
+# The pyramid is written next to tiles_dir and then replaces it whole, so no tile of an earlier
+# render is left behind for the page to fetch.
+def write_heat_tiles(latitudes, longitudes, tiles_dir, zooms, weights=None, workers=None):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+    tmp_dir = f'{tiles_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    levels = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(write_zoom_level, latitudes, longitudes, weights, tmp_dir, zoom)
+                for zoom in zooms
+            ]
+            for future in futures:
+                zoom, tile_count, max_weight = future.result()
+                levels[str(zoom)] = {'tiles': tile_count, 'max_weight': max_weight}
+
+        with open(os.path.join(tmp_dir, 'index.json'), 'w') as file:
+            json.dump({'zooms': sorted(zooms), 'levels': levels}, file)
+        replace_folder(tmp_dir, tiles_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return levels
+
+
+# Heat layer that fetches only the tiles in view from a write_heat_tiles folder.
+# Browsers block fetch() on file:// pages, so the map folder has to be served over HTTP.
+class TiledHeatMap(JSCSSMixin, MacroElement):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var layer = L.heatLayer([], {{ this.options|tojson }}).addTo(map);
+            var tilesUrl = {{ this.tiles_url|tojson }};
+            var minZoom = {{ this.min_zoom }}, maxZoom = {{ this.max_zoom }};
+            var maxLat = {{ this.max_latitude }};
+            var tiles = {};
+
+            function tileLevel() {
+                return Math.max(minZoom, Math.min(maxZoom, map.getZoom()));
+            }
+            function tileX(lon, n) {
+                return Math.min(n - 1, Math.max(0, Math.floor((lon + 180) / 360 * n)));
+            }
+            function tileY(lat, n) {
+                var r = Math.max(-maxLat, Math.min(maxLat, lat)) * Math.PI / 180;
+                var y = Math.floor((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n);
+                return Math.min(n - 1, Math.max(0, y));
+            }
+            function refresh() {
+                var z = tileLevel(), n = Math.pow(2, z), bounds = map.getBounds();
+                var x0 = tileX(bounds.getWest(), n), x1 = tileX(bounds.getEast(), n);
+                var y0 = tileY(bounds.getNorth(), n), y1 = tileY(bounds.getSouth(), n);
+                var requests = [];
+                for (var x = x0; x <= x1; x++) {
+                    for (var y = y0; y <= y1; y++) {
+                        var key = z + '/' + x + '/' + y;
+                        if (!(key in tiles)) {
+                            // Missing tiles are empty: write_heat_tiles skips tiles without points
+                            tiles[key] = fetch(tilesUrl + '/' + key + '.json')
+                                .then(function(response) { return response.ok ? response.json() : []; })
+                                .catch(function() { return []; });
+                        }
+                        requests.push(tiles[key]);
+                    }
+                }
+                Promise.all(requests).then(function(results) {
+                    if (z === tileLevel()) {
+                        layer.setLatLngs([].concat.apply([], results));
+                    }
+                });
+            }
+            map.on('moveend', refresh);
+            refresh();
+        })();
+        {% endmacro %}
+    """)
+
+    default_js = HeatMap.default_js
+
+    def __init__(self, tiles_url, zooms, radius=25, blur=15, min_opacity=0.5):
+        super().__init__()
+        self._name = 'TiledHeatMap'
+        self.tiles_url = tiles_url.rstrip('/')
+        self.min_zoom = min(zooms)
+        self.max_zoom = max(zooms)
+        self.max_latitude = MAX_LATITUDE
+        self.options = {'radius': radius, 'blur': blur, 'minOpacity': min_opacity}
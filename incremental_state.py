@@ -0,0 +1,169 @@
+import itertools
+import json
+import os
+import numpy as np
+from data_loader import iter_records
+from event_table import CityDictionary, EventTable, as_table, build_table
+from city_stats import CityStats, STAT_FIELDS, aggregate_by_city, merge_city_stats
+from grid_binning import HeatCells
+from map_data import MapSelection, require_events, select_events, select_rows
+from profiling import stage
+
+# Bump whenever the saved layout or the meaning of a saved field changes
+STATE_VERSION = 1
+
+# Heat cell size (degrees) kept in the state; fine enough to look unbinned at city zoom
+DEFAULT_CELL_SIZE = 0.01
+
+# Records per batch in chunked (out-of-core) aggregation
+CHUNK_RECORDS = 100000
+
+
+# The parameters a state was aggregated with; a saved state is only reused for the same config
+def map_config(value_column=None, classes=None, label=None, cell_size=DEFAULT_CELL_SIZE):
+    config = {'value_column': value_column, 'classes': classes, 'label': label, 'cell_size': cell_size}
+    return json.loads(json.dumps(config))  # Tuples become lists, as they will after a save/load
+
+
+def _empty_stats():
+    empty = {name: np.empty(0) for name in STAT_FIELDS}
+    empty['codes'] = np.empty(0, dtype=np.int32)
+    empty['count'] = np.empty(0, dtype=np.int64)
+    empty['first_date'] = np.empty(0, dtype=np.int32)
+    empty['last_date'] = np.empty(0, dtype=np.int32)
+    empty['first_row'] = np.empty(0, dtype=np.int64)
+    return CityStats(**empty)
+
+
+# Persistent per-city and per-cell aggregates for one map, updated with new records only
+class AggregateState:
+    def __init__(self, config, city_names=(), stats=None, cells=None, rows=0):
+        self.config = map_config(**config)
+        self.cities = CityDictionary(city_names)
+        self.city_names = self.cities.names
+        self.stats = stats if stats is not None else _empty_stats()
+        self.cells = cells if cells is not None else HeatCells.from_points([], [], cell_size=self._cell_size())
+        self.rows = rows  # Records seen so far, so new rows number after the old ones
+
+    def _cell_size(self):
+        cell_size = self.config['cell_size']
+        return tuple(cell_size) if isinstance(cell_size, list) else cell_size
+
+    # Translate a table's city codes into this state's codes, registering new cities
+    def _city_lookup(self, table):
+        cities = table.cities
+        lookup = [self.cities.code(name, cities.latitude[code], cities.longitude[code]) for code, name in enumerate(cities.names)]
+        return np.array(lookup + [-1], dtype=np.int32)  # Code -1 indexes the trailing -1
+
+    # Fold new records into the aggregates; cost depends only on the new records. region keeps
+    # only the records inside it (see select_rows); the state itself does not record it.
+    def update(self, data, region=None):
+        table = as_table(data)
+        config = self.config
+        classes = None if config['classes'] is None else [tuple(c) for c in config['classes']]
+        rows = select_rows(table, config['value_column'], classes, config['label'], region)
+        latitudes = table.latitude[rows]
+        longitudes = table.longitude[rows]
+        values = None if config['value_column'] is None else getattr(table, config['value_column'])[rows]
+
+        codes = self._city_lookup(table)[table.city[rows]]
+        delta = aggregate_by_city(codes, latitudes, longitudes, table.date[rows], values, rows + self.rows)
+        self.stats = merge_city_stats(self.stats, delta)
+        self.cells = self.cells.merge(HeatCells.from_points(latitudes, longitudes, values, self._cell_size()))
+        self.rows += len(table)
+        return self
+
+    # MapSelection for select_events; the map must ask for what the state was built with. Heat points
+    # are the cells, weighted by their value sums, or by their event counts when unweighted (as bin_points,
+    # and then weights is counts)
+    def selection(self, value_column=None, classes=None, label=None, weighted=False):
+        requested = map_config(value_column, classes, label, self.config['cell_size'])
+        if requested != self.config:
+            raise ValueError(f"State was aggregated for {self.config}, not {requested}")
+        latitudes, longitudes, weights = self.cells.points(weighted)
+        counts = self.cells.count.astype(np.float64) if weighted else weights
+        total = self.cells.count.sum() or np.nan  # Empty: see require_events
+        center = [self.cells.latitude_sum.sum() / total, self.cells.longitude_sum.sum() / total]
+        return MapSelection(latitudes, longitudes, weights, self.stats, self.city_names, center, counts=counts)
+
+
+# Write the state to a single .npz file (atomically)
+def save_state(state, path):
+    meta = {'version': STATE_VERSION, 'config': state.config, 'city_names': state.city_names, 'rows': state.rows}
+    arrays = {f'stats_{name}': column for name, column in state.stats.columns().items()}
+    arrays.update({f'cells_{name}': column for name, column in state.cells.columns().items()})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+
+
+# Load a saved state, or None when it is missing, from another version or built with another config
+def load_state(path, config):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        meta = json.loads(str(saved['meta']))
+        if meta['version'] != STATE_VERSION or meta['config'] != map_config(**config):
+            return None
+        stats = CityStats(**{name: saved[f'stats_{name}'] for name in STAT_FIELDS})
+        state = AggregateState(meta['config'], meta['city_names'], stats, rows=meta['rows'])
+        cells = {name: saved[f'cells_{name}'] for name in state.cells.columns()}
+    state.cells = HeatCells(state._cell_size(), **cells)
+    return state
+
+
+# Daily refresh: fold new_data into the saved state and save it. When the saved state is missing
+# or stale (other version or thresholds) it is rebuilt from rebuild_from, the full history that
+# already includes new_data; a stale state without rebuild_from is an error.
+def update_state(path, config, new_data, rebuild_from=None):
+    state = load_state(path, config)
+    if state is None:
+        if rebuild_from is None and os.path.exists(path):
+            raise ValueError(f"{path} was built with another version or config; pass rebuild_from to rebuild it")
+        state = AggregateState(config)
+        state.update(rebuild_from if rebuild_from is not None else new_data)
+    else:
+        state.update(new_data)
+    save_state(state, path)
+    return state
+
+
+# Batches of an input for chunked aggregation: row slices of an EventTable (cheap on a memory-mapped
+# cache), or tables built from at most chunk_size records of a JSON path or record iterable
+def iter_chunks(data, chunk_size=CHUNK_RECORDS):
+    if isinstance(data, EventTable):
+        for start in range(0, len(data), chunk_size):
+            yield data.take(slice(start, start + chunk_size))
+        return
+    records = iter(iter_records(data) if isinstance(data, str) else data)
+    while True:
+        batch = list(itertools.islice(records, chunk_size))
+        if not batch:
+            return
+        yield build_table(batch)
+
+
+# Out-of-core aggregation: read data (an EventTable, a merged_data JSON path or records) in batches
+# of chunk_size records and fold each batch into one AggregateState per config, in a single read.
+# Memory stays bounded by the batch plus the cities and heat cells of the states.
+def aggregate_chunks(data, configs, chunk_size=CHUNK_RECORDS, region=None):
+    states = [AggregateState(config) for config in configs]
+    with stage('aggregate_chunks') as info:
+        chunks = 0
+        for chunk in iter_chunks(data, chunk_size):
+            for state in states:
+                state.update(chunk, region)
+            chunks += 1
+        info['chunks'] = chunks
+        info['records'] = states[0].rows if states else 0
+    return states
+
+
+# select_events for the chunked mode of the generators: the map's aggregates are built batch by
+# batch, so heat points are the state's cells (DEFAULT_CELL_SIZE) rather than single events, with
+# the same points and weights as select_events binned with grid_size=DEFAULT_CELL_SIZE
+def chunked_selection(data, chunk_size, value_column=None, classes=None, label=None, weighted=False, region=None):
+    [state] = aggregate_chunks(data, [map_config(value_column, classes, label)], chunk_size, region)
+    require_events(state.cells, label, region)
+    return select_events(state, value_column, classes, label, weighted)
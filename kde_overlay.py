@@ -0,0 +1,171 @@
+import base64
+import struct
+import zlib
+import numpy as np
+import folium
+from folium.raster_layers import ImageOverlay
+
+# Raster width in pixels; the height follows from the data bounds in Web Mercator
+KDE_WIDTH = 1024
+
+# Gaussian kernel standard deviation, in raster pixels
+KDE_BANDWIDTH = 6.0
+
+# Overlay opacity where the density is highest
+KDE_OPACITY = 0.8
+
+# Share of the peak density below which the overlay is transparent (and, for weighted maps,
+# below which the smoothed mean is not shown)
+KDE_CUTOFF = 0.01
+
+# Color stops (position, (r, g, b)) of leaflet.heat's default gradient, so the overlay reads like HeatMap
+GRADIENT = (
+    (0.4, (0, 0, 255)),
+    (0.6, (0, 255, 255)),
+    (0.7, (0, 255, 0)),
+    (0.8, (255, 255, 0)),
+    (1.0, (255, 0, 0)),
+)
+
+# Web Mercator cannot show the poles, the raster stops at this latitude
+MAX_LATITUDE = 85.0511287798
+
+
+# Options of the density overlay: kde=True uses the defaults; a dict can set width, bandwidth,
+# opacity and cutoff
+def kde_options(kde):
+    if not kde:
+        return None
+    options = {'width': KDE_WIDTH, 'bandwidth': KDE_BANDWIDTH, 'opacity': KDE_OPACITY, 'cutoff': KDE_CUTOFF}
+    if isinstance(kde, dict):
+        unknown = set(kde) - set(options)
+        if unknown:
+            raise ValueError(f"Unknown kde option(s) {sorted(unknown)}, expected {sorted(options)}")
+        options.update(kde)
+    return options
+
+
+def mercator_y(latitudes):
+    latitudes = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    return np.log(np.tan(np.pi / 4 + latitudes / 2))
+
+
+# Bin points to a raster with square pixels in Web Mercator covering (south, west, north, east).
+# Row 0 is the northern edge. Returns the summed weights (or counts) per pixel.
+def mercator_grid(latitudes, longitudes, weights, bounds, width=KDE_WIDTH):
+    south, west, north, east = bounds
+    top, bottom = mercator_y(north), mercator_y(south)
+    span_x = np.radians(east - west)
+    height = max(1, int(round(width * (top - bottom) / span_x)))
+    columns = ((np.radians(np.asarray(longitudes) - west) / span_x) * width).astype(np.int64)
+    rows = (((top - mercator_y(latitudes)) / (top - bottom)) * height).astype(np.int64)
+    np.clip(columns, 0, width - 1, out=columns)
+    np.clip(rows, 0, height - 1, out=rows)
+    grid = np.bincount(rows * width + columns, weights=weights, minlength=height * width)
+    return grid.reshape(height, width).astype(np.float64)
+
+
+# Convolve a raster with a Gaussian of sigma pixels via FFT, zero-padded so edges do not wrap.
+# The kernel is applied through its analytic transfer function, so no kernel array is built.
+def gaussian_smooth(grid, sigma):
+    pad = int(np.ceil(3 * sigma))
+    height, width = grid.shape
+    shape = (height + 2 * pad, width + 2 * pad)
+    padded = np.zeros(shape)
+    padded[pad:pad + height, pad:pad + width] = grid
+    frequency_y = np.fft.fftfreq(shape[0])[:, None]
+    frequency_x = np.fft.rfftfreq(shape[1])[None, :]
+    transfer = np.exp(-2 * np.pi ** 2 * sigma ** 2 * (frequency_y ** 2 + frequency_x ** 2))
+    return np.fft.irfft2(np.fft.rfft2(padded) * transfer, s=shape)[pad:pad + height, pad:pad + width]
+
+
+# Data bounds (south, west, north, east) with a margin of a few kernel widths
+def density_bounds(latitudes, longitudes, width=KDE_WIDTH, bandwidth=KDE_BANDWIDTH):
+    south, north = float(np.min(latitudes)), float(np.max(latitudes))
+    west, east = float(np.min(longitudes)), float(np.max(longitudes))
+    margin = max(east - west, 1e-3) * 3 * bandwidth / width
+    return (max(south - margin, -MAX_LATITUDE), max(west - margin, -180.0),
+            min(north + margin, MAX_LATITUDE), min(east + margin, 180.0))
+
+
+# Kernel density surface and the values it shows: the event density scaled to its peak, or with
+# weights the kernel-smoothed mean weight (e.g. temperature) where there are events nearby.
+# counts is the number of events behind each point of pre-aggregated data (weights then being
+# per-point sums), None for one event per point.
+# Returns (values, coverage, bounds, (lowest, highest)); coverage in [0, 1] drives the opacity.
+def density_surface(latitudes, longitudes, weights=None, options=None, counts=None):
+    options = options or kde_options(True)
+    bounds = density_bounds(latitudes, longitudes, options['width'], options['bandwidth'])
+    counts = gaussian_smooth(mercator_grid(latitudes, longitudes, counts, bounds, options['width']), options['bandwidth'])
+    np.maximum(counts, 0.0, out=counts)  # FFT round-off leaves tiny negative densities
+    peak = counts.max() or 1.0
+    coverage = counts / peak
+    if weights is None:
+        return coverage, coverage, bounds, (0.0, 1.0)
+    sums = gaussian_smooth(mercator_grid(latitudes, longitudes, weights, bounds, options['width']), options['bandwidth'])
+    covered = coverage >= options['cutoff']
+    means = np.zeros_like(counts)
+    means[covered] = sums[covered] / counts[covered]
+    lowest, highest = (float(means[covered].min()), float(means[covered].max())) if covered.any() else (0.0, 1.0)
+    values = (means - lowest) / ((highest - lowest) or 1.0)
+    return values, coverage, bounds, (lowest, highest)
+
+
+# RGBA image of values in [0, 1] on the heat gradient; transparent below the cutoff
+def colorize(values, coverage, opacity=KDE_OPACITY, cutoff=KDE_CUTOFF):
+    positions = [position for position, _ in GRADIENT]
+    image = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        image[..., channel] = np.interp(values, positions, [color[channel] for _, color in GRADIENT])
+    alpha = np.clip((coverage - cutoff) / (0.2 - cutoff), 0.0, 1.0) * opacity
+    image[..., 3] = (alpha * 255).astype(np.uint8)
+    return image
+
+
+# PNG data URL of an RGBA uint8 image: the filtered scanlines are built with one NumPy concatenation
+# instead of folium's row-by-row encoder
+def png_data_url(image):
+    height, width, _ = image.shape
+    scanlines = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    png = (b'\x89PNG\r\n\x1a\n'
+           + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+           + chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6))
+           + chunk(b'IEND', b''))
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+
+# Colorbar legend of the overlay, in the style of the maps' fixed legend boxes
+def add_colorbar(map_obj, title, value_range, unit=''):
+    stops = ', '.join(f'rgb{color} {position * 100:.0f}%' for position, color in GRADIENT)
+    lowest, highest = value_range
+    low_label, high_label = (('low', 'high') if value_range == (0.0, 1.0)
+                             else (f'{lowest:.1f}{unit}', f'{highest:.1f}{unit}'))
+    legend_html = f'''
+    <div style="position: fixed; bottom: 30px; right: 30px; width: 200px; background-color: rgba(255, 255, 255, 0.7); z-index:9999; border-radius: 10px; padding: 10px; font-size: 12px;">
+        <b>{title}</b><br>
+        <div style="height: 12px; margin: 6px 0 2px 0; background: linear-gradient(to right, rgb(0, 0, 255) 0%, {stops});"></div>
+        <span style="float: left;">{low_label}</span><span style="float: right;">{high_label}</span><br>
+    </div>
+    '''
+    map_obj.get_root().html.add_child(folium.Element(legend_html))
+
+
+# Add a server-side kernel density overlay (a PNG ImageOverlay) and its colorbar to a map.
+# weights turns the surface into the smoothed mean weight; unit labels the colorbar values; counts
+# weighs pre-aggregated points by their events (see density_surface).
+def add_kde_layer(map_obj, latitudes, longitudes, weights=None, kde=True, title='Event density', unit='', counts=None):
+    options = kde_options(kde)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if len(latitudes) == 0:
+        raise ValueError("A density overlay needs at least one point")
+    values, coverage, bounds, value_range = density_surface(latitudes, longitudes, weights, options, counts)
+    south, west, north, east = bounds
+    layer = ImageOverlay(png_data_url(colorize(values, coverage, options['opacity'], options['cutoff'])),
+                         bounds=[[south, west], [north, east]], pixelated=False, name=title)
+    layer.add_to(map_obj)
+    add_colorbar(map_obj, title, value_range, unit)
+    return layer
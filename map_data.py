@@ -0,0 +1,196 @@
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+from event_table import as_table, read_cache, write_cache
+from city_stats import aggregate_by_city, merge_city_stats
+from classify import classify_array, class_code
+from spatial_index import index_for
+from profiling import stage
+
+
+# What a map draws, however the data was provided: heat points (with optional weights),
+# per-city statistics with the names their codes refer to, and the map center.
+# dates holds the day number of every heat point, or None for pre-aggregated data; counts holds
+# the number of events behind every heat point of pre-aggregated data, or None (one event each).
+class MapSelection:
+    def __init__(self, latitudes, longitudes, weights, stats, city_names, center, dates=None, counts=None):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.weights = weights
+        self.stats = stats
+        self.city_names = city_names
+        self.center = center
+        self.dates = dates
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.latitudes)
+
+
+# A map needs at least one event: raise a clear error for an empty selection (a region or class
+# without events) instead of letting the map fail halfway through rendering
+def require_events(selection, label=None, region=None):
+    if len(selection) == 0:
+        what = 'No events' if label is None else f'No {label} events'
+        raise ValueError(what if region is None else f'{what} in region {tuple(region)}')
+    return selection
+
+
+# Sorted rows a map uses: events in the given class, every event with a value when classes is None,
+# or every event when there is no value column; limited to region when one is given (see spatial_index)
+def select_rows(table, value_column=None, classes=None, label=None, region=None):
+    rows = np.arange(len(table)) if region is None else index_for(table).query(region)
+    return _filter_rows(table, rows, value_column, classes, label)
+
+
+# The given sorted rows that select_rows keeps
+def _filter_rows(table, rows, value_column=None, classes=None, label=None):
+    if value_column is None:
+        return rows
+    values = getattr(table, value_column)[rows]
+    if classes is None:
+        return rows[~np.isnan(values)]
+    return rows[classify_array(values, classes) == class_code(classes, label)]
+
+
+# Select and aggregate the events of one map. data is an EventTable, an iterable of records or a
+# pre-aggregated input with a selection() method (see incremental_state). weighted uses the value
+# column as heat weights. workers > 1 classifies and aggregates in that many processes, with the
+# same result as the serial pass (see _parallel_selections).
+def select_events(data, value_column=None, classes=None, label=None, weighted=False, region=None, workers=None):
+    if hasattr(data, 'selection'):
+        if region is not None:
+            raise ValueError("Region queries need the event table, not pre-aggregated data")
+        with stage('aggregate') as info:
+            selection = data.selection(value_column, classes, label, weighted)
+            info['cities'] = len(selection.stats)
+        return require_events(selection, label)
+
+    with stage('load') as info:
+        table = as_table(data)
+        info['records'] = len(table)
+    if workers and workers > 1:
+        selection = _parallel_selections(table, value_column, classes, [label], weighted, region, workers)[label]
+        return require_events(selection, label, region)
+    with stage('classify') as info:
+        rows = select_rows(table, value_column, classes, label, region)
+        info['rows'] = len(rows)
+    with stage('aggregate') as info:
+        selection = _selection_for_rows(table, rows, value_column, weighted)
+        info['cities'] = len(selection.stats)
+    return require_events(selection, label, region)
+
+
+# Aggregate the given rows of a table into a MapSelection (stats when already aggregated)
+def _selection_for_rows(table, rows, value_column=None, weighted=False, stats=None):
+    latitudes = table.latitude[rows]
+    longitudes = table.longitude[rows]
+    values = None if value_column is None else getattr(table, value_column)[rows]
+    if stats is None:
+        stats = aggregate_by_city(table.city[rows], latitudes, longitudes, table.date[rows], values, rows)
+    center = [np.mean(latitudes), np.mean(longitudes)] if len(rows) else [np.nan, np.nan]  # Empty: see require_events
+    return MapSelection(latitudes, longitudes, values if weighted else None, stats, table.city_names, center, table.date[rows])
+
+
+# Select and aggregate several classes of one value column at once: the values are classified in
+# a single pass and the rows split by class with one stable sort, so each row is aggregated only
+# for its own class. Returns {label: MapSelection} for the requested labels (default: all classes).
+def select_classes(data, value_column, classes, labels=None, weighted=False, region=None, workers=None):
+    labels = [name for name, _, _ in classes] if labels is None else list(labels)
+    with stage('load') as info:
+        table = as_table(data)
+        info['records'] = len(table)
+    if workers and workers > 1:
+        selections = _parallel_selections(table, value_column, classes, labels, weighted, region, workers)
+        return {label: require_events(selection, label, region) for label, selection in selections.items()}
+    with stage('classify') as info:
+        rows = np.arange(len(table)) if region is None else index_for(table).query(region)
+        codes = classify_array(getattr(table, value_column)[rows], classes)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        info['rows'] = len(rows)
+    with stage('aggregate') as info:
+        selections = {}
+        for label in labels:
+            code = class_code(classes, label)
+            start, end = np.searchsorted(sorted_codes, [code, code + 1])
+            selections[label] = _selection_for_rows(table, rows[order[start:end]], value_column, weighted)
+        info['cities'] = sum(len(selection.stats) for selection in selections.values())
+    return {label: require_events(selection, label, region) for label, selection in selections.items()}
+
+
+_worker_tables = {}
+
+
+# The memory-mapped table of a cache, opened once per worker process
+def _worker_table(cache_dir):
+    table = _worker_tables.get(cache_dir)
+    if table is None:
+        table = _worker_tables[cache_dir] = read_cache(cache_dir)
+    return table
+
+
+# Worker: classify one slice of the candidate rows (a (start, stop) range or the rows themselves)
+# and return, per label, its sorted rows plus the same rows split into city buckets (code % buckets)
+def _select_slice(cache_dir, candidates, value_column, classes, labels, buckets):
+    table = _worker_table(cache_dir)
+    candidates = np.arange(*candidates) if isinstance(candidates, tuple) else candidates
+    if classes is None:
+        groups = {label: _filter_rows(table, candidates, value_column) for label in labels}
+    else:
+        codes = classify_array(getattr(table, value_column)[candidates], classes)
+        groups = {label: candidates[codes == class_code(classes, label)] for label in labels}
+
+    selected = {}
+    for label, rows in groups.items():
+        bucket = (table.city[rows] % buckets).astype(np.int16)  # Code -1 lands in the last bucket
+        order = np.argsort(bucket, kind='stable')
+        bounds = np.searchsorted(bucket[order], np.arange(buckets + 1)).tolist()
+        by_bucket = rows[order]
+        selected[label] = (rows, [by_bucket[bounds[b]:bounds[b + 1]] for b in range(buckets)])
+    return selected
+
+
+# Worker: aggregate every event of one city bucket (sorted rows)
+def _aggregate_bucket(cache_dir, rows, value_column):
+    table = _worker_table(cache_dir)
+    values = None if value_column is None else getattr(table, value_column)[rows]
+    return aggregate_by_city(table.city[rows], table.latitude[rows], table.longitude[rows], table.date[rows], values, rows)
+
+
+# Parallel select_events / select_classes. Workers memory-map the table's columnar cache (an
+# in-memory table is written to a temporary one first). The candidate rows are classified in
+# contiguous slices, then aggregated by city bucket: a city's events all go to one worker in row
+# order, so its sums are reduced exactly as in the serial pass, and merging the disjoint partials
+# (ordered by first_row) gives bit-identical statistics and the same tie-breaks.
+def _parallel_selections(table, value_column, classes, labels, weighted, region, workers):
+    candidates = None if region is None else index_for(table).query(region)
+    total = len(table) if candidates is None else len(candidates)
+    bounds = np.linspace(0, total, workers + 1).astype(np.int64).tolist()
+    slices = [(start, stop) if candidates is None else candidates[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    with tempfile.TemporaryDirectory(prefix='heat_table_') as tmp_dir:
+        cache_dir = table.cache_dir
+        if cache_dir is None:
+            write_cache(table, tmp_dir, {})
+            cache_dir = tmp_dir
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            with stage('classify') as info:
+                parts = list(executor.map(_select_slice, repeat(cache_dir), slices, repeat(value_column), repeat(classes),
+                                          repeat(labels), repeat(workers)))
+                info['rows'] = sum(len(part[label][0]) for part in parts for label in labels)
+                info['workers'] = workers
+            with stage('aggregate') as info:
+                futures = {
+                    label: [executor.submit(_aggregate_bucket, cache_dir, np.concatenate([part[label][1][b] for part in parts]), value_column)
+                            for b in range(workers)]
+                    for label in labels
+                }
+                selections = {}
+                for label in labels:
+                    rows = np.concatenate([part[label][0] for part in parts])
+                    stats = merge_city_stats(*[future.result() for future in futures[label]])
+                    selections[label] = _selection_for_rows(table, rows, value_column, weighted, stats)
+                info['cities'] = sum(len(selection.stats) for selection in selections.values())
+    return selections
@@ -0,0 +1,9 @@
+# Map name -> (script module, entry point, output file)
+MAP_JOBS = {
+    'frequency': ('earthquake_frequency', 'generate_heatmap', 'heatmap.html'),
+    'high_magnitude': ('earthquake_highmag_heat', 'generate_heatmap', 'heat22map.html'),
+    'low_magnitude': ('earthquake_low_mag', 'generate_heatmap', 'heatmap_low_mag.html'),
+    'high_rainfall': ('rainfall_highrainfall_heat', 'generate_heatmap', 'rainfall_heatmap.html'),
+    'low_rainfall': ('rainfall_lowrainfall_heat', 'generate_heatmap', 'lowrainfall_heatmap_low_mag.html'),
+    'temperature': ('tempreture_heat_marker', 'generate_temperature_heatmap', 'temperature_heatmap.html'),
+}
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+from folium.plugins import HeatMap, HeatMapWithTime
+from grid_binning import bin_points
+from kde_overlay import add_kde_layer
+from heat_tiles import TiledHeatMap, write_heat_tiles
+from time_slices import period_heat_data
+from profiling import stage
+from stream_html import StreamedArray, write_page
+from static_assets import artifact_options, minify_page, remove_compressed, vendor_page, write_compressed
+
+# Suffix of the folder next to a map file that holds its heat tile pyramid
+TILES_SUFFIX = '_tiles'
+
+
+# Tile folder belonging to a map file, so maps sharing an output folder never share tiles
+def tiles_folder_for(output_path):
+    return os.path.splitext(output_path)[0] + TILES_SUFFIX
+
+
+# Add the heat layer for the given points to a map. By default the points are embedded in the page,
+# binned to grid_size degrees when set; with tile_zooms they are written as a tile pyramid next to
+# the map file and the page only loads the tiles in view. With period ('day', 'week' or 'month')
+# the points are split by their dates into an animated HeatMapWithTime, one frame per period.
+# With kde (see kde_overlay) the density is computed here and drawn as an image with a colorbar
+# titled kde_title (values in kde_unit when weighted), so the browser does no heat computation.
+# counts is the number of events behind each point of pre-aggregated data (see MapSelection).
+def add_heat_layer(map_obj, output_path, latitudes, longitudes, weights=None, grid_size=None, tile_zooms=None,
+                   dates=None, period=None, kde=None, kde_title='Event density', kde_unit='', counts=None):
+    with stage('heat_layer') as info:
+        info['points'] = len(latitudes)
+        if kde:
+            if period or tile_zooms:
+                raise ValueError("A density overlay cannot be combined with period or tile_zooms")
+            # Weights that are the counts themselves (unweighted pre-aggregated data) hold no values to average
+            values = None if weights is counts else weights
+            return add_kde_layer(map_obj, latitudes, longitudes, values, kde, kde_title, kde_unit, counts)
+        if period:
+            if dates is None:
+                raise ValueError("A time-sliced heat layer needs event dates, pre-aggregated data has none")
+            labels, data = period_heat_data(latitudes, longitudes, dates, period, weights, grid_size)
+            return HeatMapWithTime(data, index=labels).add_to(map_obj)
+        if tile_zooms:
+            tiles_dir = tiles_folder_for(output_path)
+            write_heat_tiles(latitudes, longitudes, tiles_dir, tile_zooms, weights)
+            return TiledHeatMap(os.path.basename(tiles_dir), tile_zooms).add_to(map_obj)
+        if grid_size is not None:
+            latitudes, longitudes, weights = bin_points(latitudes, longitudes, weights, grid_size)
+        columns = [np.asarray(column, dtype=np.float64) for column in (latitudes, longitudes, weights) if column is not None]
+        if any(np.isnan(column).any() for column in columns):
+            raise ValueError("data may not contain NaNs.")
+        # The points are streamed into the page by save_map instead of becoming one list per point
+        layer = HeatMap([])
+        layer.data = StreamedArray(columns)
+        return layer.add_to(map_obj)
+
+
+# Save a map atomically: render to a temporary file next to the target, then rename over it,
+# so concurrent renders and readers never see a half-written page. folium renders the page
+# skeleton; the large layer arrays (see stream_html) are written into it in chunks, with the
+# coordinates rounded to precision decimals when it is set. artifacts packages the map for offline
+# serving (see static_assets.artifact_options): CDN assets vendored into a shared static folder,
+# minified page and arrays, and .gz/.br siblings.
+def save_map(map_obj, output_path, precision=None, artifacts=None):
+    options = artifact_options(artifacts)
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    with stage('save') as info:
+        html = map_obj.get_root().render()
+        if options and options['static_dir']:
+            html = vendor_page(html, output_path, options['static_dir'])
+        if options and options['minify']:
+            html = minify_page(html)
+        try:
+            info['streamed'] = write_page(html, tmp_path, precision, compact=bool(options and options['minify']))
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        remove_compressed(output_path)
+        if options and options['compress']:
+            info['compressed'] = {path: os.path.getsize(path) for path in write_compressed(output_path)}
+        info['bytes'] = os.path.getsize(output_path)
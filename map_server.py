@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import functools
+import importlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from event_maps import generate_class_map, map_query
+from event_table import dates_to_days, days_to_dates, load_table
+from grid_binning import heat_points
+from map_data import select_events
+from map_jobs import MAP_JOBS
+
+# Localhost only by default: the server has no authentication
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+
+# Memory cap of the cached responses
+DEFAULT_CACHE_BYTES = 256 << 20
+
+# Generator options a request may set in its query string (values parsed as JSON)
+SERVER_OPTIONS = ('grid_size', 'bulk_markers', 'clustered_markers', 'period', 'hottest_cities', 'coldest_cities', 'rank_by',
+                  'precision', 'kde')
+
+# Longest request line or header accepted
+MAX_LINE = 8192
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+# Responses by key, least recently used first, evicted once their total size passes max_bytes
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, content_type, body):
+        if len(body) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)[1])
+        self.entries[key] = (content_type, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+# Request parameters: the date range (inclusive ISO dates), the bbox as a region and the options
+def parse_params(query):
+    params = dict(urllib.parse.parse_qsl(query))
+    start = params.pop('start', None)
+    end = params.pop('end', None)
+    bbox = params.pop('bbox', None)
+    label = params.pop('class', None)
+    days = (None if start is None else int(dates_to_days([start])[0]), None if end is None else int(dates_to_days([end])[0]))
+    region = None if bbox is None else tuple(float(value) for value in bbox.split(','))
+    if region is not None and len(region) != 4:
+        raise ValueError("bbox must be south,west,north,east")
+    unknown = set(params) - set(SERVER_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) {sorted(unknown)}")
+    return days, region, label, {key: _parse_value(value) for key, value in params.items()}
+
+
+# Keeps one merged_data table resident and renders pages and data for requests. Renders run on one
+# background thread, so the event loop keeps answering cached requests meanwhile.
+class MapServer:
+    def __init__(self, json_path, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.table = load_table(json_path)
+        self.cache = ResponseCache(cache_bytes)
+        self.output_folder = tempfile.mkdtemp(prefix='heat_server_')
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    # Rows of the table between the first and last day (inclusive), or the whole table
+    def table_for(self, days):
+        first, last = days
+        if first is None and last is None:
+            return self.table
+        dates = self.table.date
+        keep = np.ones(len(dates), dtype=bool)
+        if first is not None:
+            keep &= dates >= first
+        if last is not None:
+            keep &= dates <= last
+        return self.table.take(keep)
+
+    # Full map page from the map's own generator, or for another class of a class map (label) from
+    # the class map engine with the map's colors and legend
+    def render_page(self, name, days, region, label, options):
+        map_query(name, label)
+        if label is None:
+            module_name, function_name, _ = MAP_JOBS[name]
+            generate = getattr(importlib.import_module(module_name), function_name)
+        else:
+            generate = functools.partial(generate_class_map, name=name, label=label)
+        parameters = inspect.signature(generate).parameters
+        options = {key: value for key, value in options.items() if key in parameters}
+        output_file = f'{name}_{time.monotonic_ns()}.html'
+        generate(self.table_for(days), output_folder=self.output_folder, output_file=output_file, region=region, **options)
+        output_path = os.path.join(self.output_folder, output_file)
+        try:
+            with open(output_path, 'rb') as file:
+                return 'text/html; charset=utf-8', file.read()
+        finally:
+            os.remove(output_path)
+
+    # Heat points and per-city statistics as JSON, for clients that draw the layers themselves
+    def render_data(self, name, days, region, label, options):
+        value_column, classes, label, weighted = map_query(name, label)
+        selection = select_events(self.table_for(days), value_column, classes, label, weighted, region)
+        stats = selection.stats
+        points = np.asarray(heat_points(selection.latitudes, selection.longitudes, selection.weights, options.get('grid_size')))
+        points = points[np.isfinite(points).all(axis=1)] if len(points) else points
+        cities = {
+            'name': stats.names(selection.city_names),
+            'latitude': stats.marker_latitude.tolist(),
+            'longitude': stats.marker_longitude.tolist(),
+            'count': stats.count.tolist(),
+            'first_date': days_to_dates(stats.first_date).tolist(),
+            'last_date': days_to_dates(stats.last_date).tolist(),
+        }
+        if value_column is not None:
+            cities.update(max_value=stats.max_value.tolist(), min_value=stats.min_value.tolist(),
+                          mean_value=stats.mean_value().tolist())
+        body = {'map': name, 'class': label, 'center': [float(value) for value in selection.center],
+                'points': points.tolist(), 'cities': cities}
+        return 'application/json', json.dumps(body).encode()
+
+    # (status, content type, body) for a GET path, from the cache when the same request was seen
+    async def respond(self, target):
+        url = urllib.parse.urlsplit(target)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts:
+            index = {'maps': list(MAP_JOBS), 'pages': '/map/<name>', 'data': '/data/<name>',
+                     'parameters': ['start', 'end', 'bbox', 'class', *SERVER_OPTIONS],
+                     'cache': {'entries': len(self.cache.entries), 'bytes': self.cache.size,
+                               'hits': self.cache.hits, 'misses': self.cache.misses}}
+            return 200, 'application/json', json.dumps(index).encode()
+        if len(parts) != 2 or parts[0] not in ('map', 'data') or parts[1] not in MAP_JOBS:
+            return 404, 'text/plain', f"No such map: {url.path}".encode()
+
+        kind, name = parts
+        key = (kind, name, tuple(sorted(urllib.parse.parse_qsl(url.query))))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return (200, *cached)
+        try:
+            days, region, label, options = parse_params(url.query)
+            loop = asyncio.get_running_loop()
+            if kind == 'map':
+                content_type, body = await loop.run_in_executor(self.executor, self.render_page, name, days, region, label, options)
+            else:
+                content_type, body = await loop.run_in_executor(self.executor, self.render_data, name, days, region, label, options)
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, 'text/plain', str(error).encode()
+        self.cache.put(key, content_type, body)
+        return 200, content_type, body
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while True:  # Headers are not used
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b'') or len(line) > MAX_LINE:
+                    break
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            if method != 'GET':
+                status, content_type, body = 405, 'text/plain', b"Only GET is supported"
+            else:
+                started = time.perf_counter()
+                try:
+                    status, content_type, body = await self.respond(target)
+                except Exception as error:
+                    status, content_type, body = 500, 'text/plain', repr(error).encode()
+                print(f"GET {target} {status} {len(body)}B {(time.perf_counter() - started) * 1000:.1f}ms")
+        except ValueError:
+            status, content_type, body = 400, 'text/plain', b"Malformed request"
+        header = (f"HTTP/1.1 {status} {_STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\n"
+                  f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        writer.write(header.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        print(f"Serving {len(self.table)} records on http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the heat maps of one merged_data file on demand.")
+    parser.add_argument('json_path')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_CACHE_BYTES / (1 << 20))
+    args = parser.parse_args(argv)
+    server = MapServer(args.json_path, int(args.cache_mb * (1 << 20)))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutil.rmtree(server.output_folder, ignore_errors=True)
+    return 0
+
+
+# Example Usage: python map_server.py path/to/merged_data.json --port 8000
+# then open http://127.0.0.1:8000/map/frequency?start=2020-01-01&bbox=30,-130,50,-60
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; RSS figures are then reported as None
+    resource = None
+
+# Environment variable that turns profiling on for every generator when its profile argument is
+# not given: '1' for stage timings, or a comma separated list of capture modes
+PROFILE_ENV = 'HEAT_PROFILE'
+
+# Optional per-stage captures: cProfile call statistics and tracemalloc allocation statistics
+CAPTURE_MODES = ('cprofile', 'tracemalloc')
+
+# Suffix of the JSON report written next to a profiled map (heatmap.html -> heatmap_profile.json)
+PROFILE_SUFFIX = '_profile.json'
+
+# Entries kept per stage from the cProfile / tracemalloc statistics
+TOP_ENTRIES = 15
+
+_OFF_VALUES = ('', '0', 'false', 'off', 'no')
+_ON_VALUES = ('1', 'true', 'on', 'yes')
+
+_active = contextvars.ContextVar('heat_profiler', default=None)
+
+
+# Current resident set size in bytes (Linux only, None elsewhere)
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Peak resident set size of this process in bytes. On Linux VmHWM is used: unlike ru_maxrss it
+# does not carry over the parent's peak through fork/exec. ru_maxrss is in bytes on macOS.
+def peak_rss_bytes():
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Capture modes requested by a profile argument (None falls back to HEAT_PROFILE), or None when
+# profiling is off. True / '1' mean timings only; 'cprofile', 'tracemalloc' or both add captures.
+def profile_options(profile=None):
+    if profile is None:
+        profile = os.environ.get(PROFILE_ENV, '')
+    if profile is True:
+        return set()
+    if profile is False or str(profile).strip().lower() in _OFF_VALUES:
+        return None
+    modes = {mode.strip().lower() for mode in str(profile).split(',')} - set(_ON_VALUES)
+    unknown = modes - set(CAPTURE_MODES)
+    if unknown:
+        raise ValueError(f"Unknown profile mode(s) {sorted(unknown)}, expected {CAPTURE_MODES} or 1")
+    return modes
+
+
+# Report file of a profiled map
+def report_path_for(output_path):
+    return os.path.splitext(output_path)[0] + PROFILE_SUFFIX
+
+
+def _top_functions(profile):
+    stats = pstats.Stats(profile).sort_stats('cumulative')
+    top = []
+    for key in stats.fcn_list[:TOP_ENTRIES]:
+        calls, _, total_time, cumulative_time, _ = stats.stats[key]
+        top.append({'function': pstats.func_std_string(key), 'calls': calls,
+                    'own_seconds': total_time, 'cumulative_seconds': cumulative_time})
+    return top
+
+
+# Stage timings of one generator run: wall time, RSS change and the counts the stage reports,
+# plus cProfile / tracemalloc statistics when those captures are on. Stages may nest
+# ('build_map/heat_layer'); captures only run for the outermost stage.
+class Profiler:
+    def __init__(self, name, capture=()):
+        self.name = name
+        self.capture = set(capture)
+        self.stages = []
+        self.profiles = {}
+        self.output_path = None
+        self.message = None
+        self._open = []
+        self._started_tracing = False
+        if 'tracemalloc' in self.capture and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.rss_start = current_rss_bytes()
+        self.started = time.perf_counter()
+        self.total_seconds = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        info = {}
+        path = '/'.join(self._open + [name])
+        outermost = not self._open
+        self._open.append(name)
+        profile = cProfile.Profile() if outermost and 'cprofile' in self.capture else None
+        tracing = outermost and 'tracemalloc' in self.capture
+        if tracing:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+            snapshot_before = tracemalloc.take_snapshot()
+        rss_before = current_rss_bytes()
+        started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield info
+        finally:
+            if profile is not None:
+                profile.disable()
+            entry = {'stage': path, 'seconds': time.perf_counter() - started}
+            rss_after = current_rss_bytes()
+            entry['rss_delta'] = None if rss_before is None or rss_after is None else rss_after - rss_before
+            if tracing:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                entry['traced_delta'] = traced - traced_before
+                entry['traced_peak'] = traced_peak - traced_before
+                differences = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')
+                entry['top_allocations'] = [str(difference) for difference in differences[:TOP_ENTRIES]]
+            if profile is not None:
+                entry['top_functions'] = _top_functions(profile)
+                self.profiles[path] = profile
+            entry.update(info)
+            self._open.pop()
+            self.stages.append(entry)
+
+    def close(self):
+        if self.total_seconds is None:
+            self.total_seconds = time.perf_counter() - self.started
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        top_level = [entry for entry in self.stages if '/' not in entry['stage']]
+        return {
+            'map': self.name,
+            'output': self.output_path,
+            'capture': sorted(self.capture),
+            'total_seconds': self.total_seconds,
+            'unstaged_seconds': self.total_seconds - sum(entry['seconds'] for entry in top_level),
+            'rss_start': self.rss_start,
+            'rss_end': current_rss_bytes(),
+            'peak_rss': peak_rss_bytes(),
+            'stages': self.stages,
+        }
+
+    # One line: the generator's own message, total time and the top-level stage times
+    # (stages that ran several times, e.g. once per map, are summed)
+    def summary(self):
+        totals = {}
+        for entry in self.stages:
+            if '/' not in entry['stage']:
+                totals[entry['stage']] = totals.get(entry['stage'], 0.0) + entry['seconds']
+        stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in totals.items())
+        message = self.message or f"{self.name} finished"
+        return f"{message} in {self.total_seconds:.2f}s ({stages})"
+
+    # Write the JSON report (and one .prof file per cProfile'd stage) next to the map
+    def write(self, report_path):
+        report = self.report()
+        for stage, profile in self.profiles.items():
+            profile_path = os.path.splitext(report_path)[0] + f"_{stage.replace('/', '_')}.prof"
+            profile.dump_stats(profile_path)
+            for entry in report['stages']:
+                if entry['stage'] == stage:
+                    entry['profile_file'] = profile_path
+        with open(report_path, 'w') as file:
+            json.dump(report, file, indent=2)
+        return report
+
+
+# Time a stage of the running profiled generator; a no-op outside one. Yields a dict the stage
+# can put counts into (e.g. info['records'] = n), which end up in the report.
+@contextlib.contextmanager
+def stage(name):
+    profiler = _active.get()
+    if profiler is None:
+        yield {}
+        return
+    with profiler.stage(name) as info:
+        yield info
+
+
+# Print the generator's "saved as" line, or hand it to the profiler, which prints it as part of
+# its one-line summary once the run is over
+def report_saved(message, output_path):
+    profiler = _active.get()
+    if profiler is None:
+        print(message)
+        return
+    profiler.message = message
+    profiler.output_path = output_path
+
+
+# Decorator for the generate_* functions: when their profile argument (or HEAT_PROFILE) asks for
+# it, record the stages of the call, write the JSON report next to the map and print one summary line
+def profiled(name):
+    def decorate(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            capture = profile_options(signature.bind_partial(*args, **kwargs).arguments.get('profile'))
+            if capture is None or _active.get() is not None:
+                return function(*args, **kwargs)
+            profiler = Profiler(name, capture)
+            token = _active.set(profiler)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                _active.reset(token)
+                profiler.close()
+            if profiler.output_path is not None:
+                report_path = report_path_for(profiler.output_path)
+                profiler.write(report_path)
+                print(f"{profiler.summary()}; profile in {report_path}")
+            else:
+                print(profiler.summary())
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,211 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+import weakref
+import numpy as np
+import folium
+from event_maps import CLASS_MAPS, classes_for
+from event_table import _source_fingerprint, as_table, load_table
+from heat_tiles import replace_folder
+from map_jobs import MAP_JOBS
+from map_layers import tiles_folder_for
+from static_assets import COMPRESSED_SUFFIXES
+
+# Bump whenever the generators' output changes for the same input and options
+RENDER_CACHE_VERSION = 1
+
+# Default cache location and limits; entries past either limit are evicted oldest-use first
+DEFAULT_CACHE_DIR = 'render_cache'
+MAX_CACHE_BYTES = 1 << 30
+MAX_ENTRY_AGE = 30 * 24 * 3600
+
+# Suffix of the file next to a map that records the key it was rendered for (and the size and
+# mtime of the page it wrote, so a page written since by anything else is not taken for it)
+RENDER_KEY_SUFFIX = '_render.json'
+
+_table_fingerprints = weakref.WeakKeyDictionary()
+
+
+# Fingerprint of a map's input: a JSON file's size/mtime (so a hit never reads it), or a hash of
+# the columns and city names of a table, or of the aggregates of a pre-aggregated state
+def input_fingerprint(data):
+    if isinstance(data, str):
+        return {'source': os.path.abspath(data), **_source_fingerprint(data)}
+    if hasattr(data, 'selection'):
+        digest = hashlib.blake2b(json.dumps([data.config, data.city_names, data.rows]).encode())
+        for column in (*data.stats.columns().values(), *data.cells.columns().values()):
+            digest.update(np.ascontiguousarray(column).tobytes())
+        return {'state': digest.hexdigest()}
+    table = as_table(data)
+    fingerprint = _table_fingerprints.get(table)
+    if fingerprint is None:
+        digest = hashlib.blake2b(json.dumps(table.city_names).encode())
+        for column in table.columns().values():
+            digest.update(np.ascontiguousarray(column).tobytes())
+        fingerprint = {'table': digest.hexdigest()}
+        _table_fingerprints[table] = fingerprint
+    return fingerprint
+
+
+# Resolved CLASS_MAPS configs a generator draws (class table, label, colors, legend): its own
+# map's config, none for the frequency and temperature maps, every one for other generators
+# (e.g. generate_class_maps)
+def _class_configs(generate):
+    module = generate.__module__
+    if module == '__main__':  # A map script run directly
+        module = os.path.splitext(os.path.basename(inspect.getfile(inspect.unwrap(generate))))[0]
+    names = [name for name, (module_name, _, _) in MAP_JOBS.items() if module_name == module] or list(CLASS_MAPS)
+    return {name: dict(CLASS_MAPS[name], classes=classes_for(CLASS_MAPS[name])) for name in names if name in CLASS_MAPS}
+
+
+# Cache key of one render: generator, input, class map configs, options and versions
+def render_key(generate, fingerprint, output_file, options):
+    key = {
+        'version': RENDER_CACHE_VERSION,
+        'folium': folium.__version__,
+        'generator': f'{generate.__module__}.{generate.__qualname__}',
+        'input': fingerprint,
+        'class_maps': _class_configs(generate),
+        'output_file': output_file,
+        'options': repr(sorted((name, value) for name, value in options.items() if name != 'profile')),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+# Default of a generator parameter (e.g. its output folder)
+def _signature_default(generate, parameter):
+    return inspect.signature(generate).parameters[parameter].default
+
+
+def _key_path(output_path):
+    return os.path.splitext(output_path)[0] + RENDER_KEY_SUFFIX
+
+
+def _page_stamp(output_path):
+    stat = os.stat(output_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Key the page at output_path was rendered for, or None when unknown or the page changed since
+def _read_key(output_path):
+    try:
+        with open(_key_path(output_path), 'r') as file:
+            sidecar = json.load(file)
+        if sidecar.get('page') != _page_stamp(output_path):
+            return None
+        return sidecar.get('key')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _write_key(output_path, key):
+    tmp_path = _key_path(output_path) + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'key': key, 'page': _page_stamp(output_path)}, file)
+    os.replace(tmp_path, _key_path(output_path))
+
+
+def _folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names)
+
+
+# Copy a rendered map (and its tile folder, if any) into the cache entry for key
+def _store(cache_dir, key, output_path):
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+    tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    shutil.copyfile(output_path, os.path.join(tmp_dir, 'map.html'))
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(output_path + suffix):
+            shutil.copyfile(output_path + suffix, os.path.join(tmp_dir, 'map.html' + suffix))
+    tiles_dir = tiles_folder_for(output_path)
+    if os.path.isdir(tiles_dir):
+        shutil.copytree(tiles_dir, os.path.join(tmp_dir, 'tiles'))
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:  # Another process stored the same key first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# Copy a cache entry to output_path (atomically for the map file) and mark it as used. A cached
+# tile folder replaces the map's current one whole, so no tile of another render survives.
+def _restore(entry_dir, output_path):
+    tiles_dir = os.path.join(entry_dir, 'tiles')
+    if os.path.isdir(tiles_dir):
+        tmp_dir = f'{tiles_folder_for(output_path)}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            shutil.copytree(tiles_dir, tmp_dir)
+            replace_folder(tmp_dir, tiles_folder_for(output_path))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    shutil.copyfile(os.path.join(entry_dir, 'map.html'), tmp_path)
+    os.replace(tmp_path, output_path)
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(os.path.join(entry_dir, 'map.html' + suffix)):
+            shutil.copyfile(os.path.join(entry_dir, 'map.html' + suffix), output_path + suffix)
+        elif os.path.exists(output_path + suffix):
+            os.remove(output_path + suffix)
+    os.utime(entry_dir)
+
+
+# Remove cache entries unused for longer than max_age seconds, then the least recently used ones
+# until the cache fits in max_bytes. Returns the number of entries removed.
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=MAX_CACHE_BYTES, max_age=MAX_ENTRY_AGE):
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and not name.endswith('.tmp'):
+            entries.append((os.path.getmtime(path), _folder_size(path), path))
+    entries.sort()
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for used, size, path in entries:
+        if now - used <= max_age and total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+# Render a map through the cache. data is a merged_data JSON path, an EventTable, records or an
+# AggregateState; output_folder/output_file default to the generator's own defaults. When the
+# output already holds this exact render nothing happens; when the cache has it, it is copied;
+# otherwise the map is rendered (loading a JSON path only then) and stored.
+# Returns (output_path, status) with status 'unchanged', 'cached' or 'rendered'.
+def cached_render(generate, data, output_folder=None, output_file=None, cache_dir=DEFAULT_CACHE_DIR,
+                  max_bytes=MAX_CACHE_BYTES, max_age=MAX_ENTRY_AGE, **options):
+    output_folder = output_folder or _signature_default(generate, 'output_folder')
+    output_file = output_file or _signature_default(generate, 'output_file')
+    output_path = os.path.join(output_folder, output_file)
+    if not isinstance(data, str) and not hasattr(data, 'selection'):
+        data = as_table(data)  # Records are consumed once, for both the key and the render
+    key = render_key(generate, input_fingerprint(data), output_file, options)
+
+    if os.path.exists(output_path) and _read_key(output_path) == key:
+        return output_path, 'unchanged'
+    os.makedirs(output_folder, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        _restore(entry_dir, output_path)
+        status = 'cached'
+    else:
+        # In chunked mode the generator streams a JSON path itself instead of loading it whole
+        table = load_table(data) if isinstance(data, str) and not options.get('chunk_size') else data
+        generate(table, output_folder=output_folder, output_file=output_file, **options)
+        os.makedirs(cache_dir, exist_ok=True)
+        _store(cache_dir, key, output_path)
+        evict(cache_dir, max_bytes, max_age)
+        status = 'rendered'
+    _write_key(output_path, key)
+    return output_path, status
@@ -0,0 +1,97 @@
+import math
+import weakref
+import numpy as np
+
+# Mean Earth radius used for "within R km" queries
+EARTH_RADIUS_KM = 6371.0088
+
+# Default bucket size in degrees
+DEFAULT_CELL_SIZE = 1.0
+
+_indexes = weakref.WeakKeyDictionary()
+
+
+# Great-circle distance in km from one point to arrays of points
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# Rows bucketed by a lat/lon grid and sorted by bucket, so a query only touches the buckets it
+# overlaps: one binary search per grid row instead of a scan over every event
+class SpatialIndex:
+    def __init__(self, latitudes, longitudes, cell_size=DEFAULT_CELL_SIZE):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_size = cell_size
+        self.grid_rows = math.ceil(180.0 / cell_size) + 1
+        self.grid_columns = math.ceil(360.0 / cell_size) + 1
+        cells = self._row(self.latitudes) * self.grid_columns + self._column(self.longitudes)
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_cells = cells[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _row(self, latitudes):
+        rows = np.floor((np.asarray(latitudes, dtype=np.float64) + 90.0) / self.cell_size)
+        return np.clip(rows, 0, self.grid_rows - 1).astype(np.int64)
+
+    def _column(self, longitudes):
+        columns = np.floor((np.asarray(longitudes, dtype=np.float64) + 180.0) / self.cell_size)
+        return np.clip(columns, 0, self.grid_columns - 1).astype(np.int64)
+
+    # Candidate rows from the buckets overlapping a box that does not cross the antimeridian
+    def _candidates(self, south, west, north, east):
+        grid_rows = np.arange(self._row(south), self._row(north) + 1)
+        starts = np.searchsorted(self.sorted_cells, grid_rows * self.grid_columns + self._column(west), 'left')
+        ends = np.searchsorted(self.sorted_cells, grid_rows * self.grid_columns + self._column(east), 'right')
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.order[np.arange(lengths.sum()) + offsets]
+
+    # Sorted rows inside a lat/lon box; west > east means the box crosses the antimeridian
+    def bbox(self, south, west, north, east):
+        if west > east:
+            return np.union1d(self.bbox(south, west, north, 180.0), self.bbox(south, -180.0, north, east))
+        rows = self._candidates(south, west, north, east)
+        latitudes, longitudes = self.latitudes[rows], self.longitudes[rows]
+        inside = (latitudes >= south) & (latitudes <= north) & (longitudes >= west) & (longitudes <= east)
+        return np.sort(rows[inside])
+
+    # Sorted rows within radius_km of a point
+    def within(self, latitude, longitude, radius_km):
+        lat_span = math.degrees(radius_km / EARTH_RADIUS_KM)
+        south, north = max(-90.0, latitude - lat_span), min(90.0, latitude + lat_span)
+        widest = max(abs(south), abs(north))
+        if widest >= 90.0 or lat_span >= 90.0:
+            rows = self.bbox(south, -180.0, north, 180.0)
+        else:
+            lon_span = lat_span / math.cos(math.radians(widest))
+            if lon_span >= 180.0:
+                rows = self.bbox(south, -180.0, north, 180.0)
+            else:
+                west = (longitude - lon_span + 180.0) % 360.0 - 180.0
+                east = (longitude + lon_span + 180.0) % 360.0 - 180.0
+                rows = self.bbox(south, west, north, east)
+        distances = haversine_km(latitude, longitude, self.latitudes[rows], self.longitudes[rows])
+        return rows[distances <= radius_km]
+
+    # Rows in a region: (south, west, north, east) box or (latitude, longitude, radius_km) circle
+    def query(self, region):
+        if len(region) == 4:
+            return self.bbox(*region)
+        if len(region) == 3:
+            return self.within(*region)
+        raise ValueError("region must be (south, west, north, east) or (latitude, longitude, radius_km)")
+
+
+# The spatial index of an EventTable, built on first use and kept as long as the table lives
+def index_for(table, cell_size=DEFAULT_CELL_SIZE):
+    index = _indexes.get(table)
+    if index is None or index.cell_size != cell_size:
+        index = SpatialIndex(table.latitude, table.longitude, cell_size)
+        _indexes[table] = index
+    return index
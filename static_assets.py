@@ -0,0 +1,120 @@
+import gzip
+import os
+import re
+import shutil
+import sys
+import urllib.parse
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only .gz siblings are written
+    brotli = None
+
+# Shared folder the CDN assets are mirrored into, one copy for every map
+DEFAULT_STATIC_DIR = 'static'
+
+# Compressed siblings written next to a packaged map (map.html.gz, map.html.br)
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+# Seconds to wait for one asset download
+DOWNLOAD_TIMEOUT = 30
+
+_ASSET_PATTERN = re.compile(r'(<script src=|<link rel="stylesheet" href=)"(https?://[^"]+)"')
+_CSS_URL_PATTERN = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+
+
+# Options of a packaged map: artifacts=True packages with the defaults; a dict can set
+# static_dir (None keeps the CDN links), minify and compress
+def artifact_options(artifacts):
+    if not artifacts:
+        return None
+    options = {'static_dir': DEFAULT_STATIC_DIR, 'minify': True, 'compress': True}
+    if isinstance(artifacts, dict):
+        unknown = set(artifacts) - set(options)
+        if unknown:
+            raise ValueError(f"Unknown artifact option(s) {sorted(unknown)}, expected {sorted(options)}")
+        options.update(artifacts)
+    return options
+
+
+# Mirror path of a URL inside static_dir (host/path), so relative references between assets still resolve
+def asset_path(url, static_dir=DEFAULT_STATIC_DIR):
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(parts.path).lstrip('/') or 'index'
+    return os.path.join(static_dir, parts.netloc, *[part for part in path.split('/') if part not in ('', '.', '..')])
+
+
+def _download(url, path):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(tmp_path, 'wb') as file:
+        shutil.copyfileobj(response, file)
+    os.replace(tmp_path, path)
+
+
+# Make sure an asset (and, for a stylesheet, the fonts and images it references) is mirrored in
+# static_dir, downloading only what is missing. Returns the local path, or None when it is
+# missing and cannot be downloaded (e.g. on an air-gapped machine with an unseeded static_dir).
+def vendor_asset(url, static_dir=DEFAULT_STATIC_DIR):
+    path = asset_path(url, static_dir)
+    if not os.path.exists(path):
+        try:
+            _download(url, path)
+        except OSError as error:
+            print(f"Could not vendor {url}: {error}", file=sys.stderr)
+            return None
+        if path.endswith('.css'):
+            with open(path, 'r', encoding='utf-8', errors='replace') as file:
+                references = _CSS_URL_PATTERN.findall(file.read())
+            for reference in references:
+                if not reference.startswith(('data:', '#')):
+                    vendor_asset(urllib.parse.urljoin(url, reference.split('#')[0].split('?')[0]), static_dir)
+    return path
+
+
+# Point the page's CDN scripts and stylesheets at their copies in static_dir, relative to the map
+def vendor_page(html, output_path, static_dir=DEFAULT_STATIC_DIR):
+    map_folder = os.path.dirname(os.path.abspath(output_path))
+
+    def local(match):
+        path = vendor_asset(match.group(2), static_dir)
+        if path is None:
+            return match.group(0)
+        return f'{match.group(1)}"{os.path.relpath(os.path.abspath(path), map_folder).replace(os.sep, "/")}"'
+    return _ASSET_PATTERN.sub(local, html)
+
+
+# Conservative minification of the folium skeleton: drop indentation, trailing spaces and blank
+# lines. Line breaks are kept, so JS relying on automatic semicolons still parses.
+def minify_page(html):
+    return '\n'.join(line.strip() for line in html.splitlines() if line.strip())
+
+
+# Write path.gz (and path.br when brotli is installed) next to a saved map, reading it in blocks
+def write_compressed(path):
+    written = []
+    tmp_path = f'{path}.gz.{os.getpid()}.tmp'
+    with open(path, 'rb') as source, open(tmp_path, 'wb') as raw, gzip.GzipFile(
+            os.path.basename(path), 'wb', 9, raw, mtime=0) as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+    os.replace(tmp_path, path + '.gz')
+    written.append(path + '.gz')
+    if brotli is not None:
+        tmp_path = f'{path}.br.{os.getpid()}.tmp'
+        compressor = brotli.Compressor(quality=11)
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+            for block in iter(lambda: source.read(1 << 20), b''):
+                target.write(compressor.process(block))
+            target.write(compressor.finish())
+        os.replace(tmp_path, path + '.br')
+        written.append(path + '.br')
+    return written
+
+
+# Drop compressed siblings left from an earlier packaged save, so they never go stale
+def remove_compressed(path):
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
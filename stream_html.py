@@ -0,0 +1,83 @@
+import json
+import re
+import uuid
+import weakref
+import numpy as np
+
+# Rows formatted and written at a time
+STREAM_CHUNK = 65536
+
+_TOKEN_PATTERN = re.compile(r'"(__stream_[0-9a-f]{32}__)"')
+
+_pending = weakref.WeakValueDictionary()
+
+
+# Stand-in for a layer's data array: renders as a unique JSON string token in the page skeleton,
+# and save_map replaces the token with the rows written straight from the columns. columns are
+# arrays (numbers) or lists (any JSON values) of equal length; row i is [column[i] for each column].
+class StreamedArray(str):
+    def __new__(cls, columns):
+        token = f'__stream_{uuid.uuid4().hex}__'
+        streamed = super().__new__(cls, token)
+        streamed.columns = list(columns)
+        _pending[token] = streamed
+        return streamed
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    # Rows as lists, for code that reads the layer data back
+    def rows(self):
+        return [list(row) for row in zip(*[np.asarray(column).tolist() for column in self.columns])]
+
+
+# Format rows of numeric columns the way json.dumps would (repr floats, ', ' separators, or ','
+# when compact) with one %-format over the whole block; blocks with NaN or non-numeric columns go
+# through json.dumps
+def _format_block(columns, precision=None, compact=False):
+    separator = ',' if compact else ', '
+    if precision is not None:
+        columns = [np.round(column, precision) if index < 2 and _is_float(column) else column
+                   for index, column in enumerate(columns)]
+    if all(_is_float(column) for column in columns):
+        block = np.column_stack(columns)
+        if np.isfinite(block).all():
+            row_format = '[' + separator.join(['%r'] * block.shape[1]) + ']'
+            return separator.join([row_format] * len(block)) % tuple(block.ravel().tolist())
+    rows = [list(row) for row in zip(*[np.asarray(column).tolist() if isinstance(column, np.ndarray) else column
+                                       for column in columns])]
+    return json.dumps(rows, separators=(separator, ':'))[1:-1]
+
+
+def _is_float(column):
+    return isinstance(column, np.ndarray) and column.dtype.kind == 'f'
+
+
+# Write a StreamedArray as a JSON array of rows, STREAM_CHUNK rows at a time. precision rounds the
+# first two (coordinate) columns to that many decimals; None keeps full float repr.
+def write_rows(file, streamed, precision=None, compact=False, chunk=STREAM_CHUNK):
+    file.write('[')
+    for start in range(0, len(streamed), chunk):
+        if start:
+            file.write(',' if compact else ', ')
+        file.write(_format_block([column[start:start + chunk] for column in streamed.columns], precision, compact))
+    file.write(']')
+
+
+# Write the rendered page to path, streaming every StreamedArray token it contains (without
+# spaces after separators when compact). Returns the number of arrays streamed.
+def write_page(html, path, precision=None, compact=False):
+    parts = _TOKEN_PATTERN.split(html)
+    streamed_count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                file.write(part)
+                continue
+            streamed = _pending.get(part)
+            if streamed is None:
+                file.write(json.dumps(part))  # Not ours: leave the string as it was
+                continue
+            write_rows(file, streamed, precision, compact)
+            streamed_count += 1
+    return streamed_count
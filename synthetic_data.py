@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import numpy as np
+
+# Date range of the generated events (inclusive), as day numbers since 1970-01-01
+FIRST_DAY = int(np.datetime64('2010-01-01', 'D').astype(np.int64))
+LAST_DAY = int(np.datetime64('2024-12-31', 'D').astype(np.int64))
+
+# Records generated and written per block
+BLOCK_SIZE = 100000
+
+# Share of cities stored as a [name, region] list, of region lists with a null element,
+# and of records without a city / rain_sum / temperature_mean
+LIST_CITY_SHARE = 0.2
+NULL_REGION_SHARE = 0.1
+MISSING_CITY_SHARE = 0.01
+MISSING_RAIN_SHARE = 0.05
+MISSING_TEMPERATURE_SHARE = 0.02
+
+
+# Default number of distinct cities for a dataset of n records
+def default_city_count(n):
+    return int(min(max(10, n // 100), 20000))
+
+
+# City values as they appear in merged_data: a name, or a [name, region] list that may hold a null
+def _city_values(city_count, rng):
+    values = []
+    for code in range(city_count):
+        name = f'City {code}'
+        if rng.random() < LIST_CITY_SHARE:
+            values.append([name, None if rng.random() < NULL_REGION_SHARE else f'Region {code % 50}'])
+        else:
+            values.append(name)
+    return values
+
+
+# Yield blocks of merged_data records (dicts) for n events. The same n, seed and city_count
+# always give the same records; coordinates scatter around per-city centers.
+def generate_blocks(n, seed=0, city_count=None, block_size=BLOCK_SIZE):
+    rng = np.random.default_rng(seed)
+    city_count = city_count or default_city_count(n)
+    city_values = _city_values(city_count, rng)
+    city_latitudes = rng.uniform(-60.0, 70.0, city_count)
+    city_longitudes = rng.uniform(-180.0, 180.0, city_count)
+
+    for start in range(0, n, block_size):
+        size = min(block_size, n - start)
+        cities = rng.integers(0, city_count, size)
+        latitudes = np.clip(city_latitudes[cities] + rng.normal(0.0, 0.5, size), -90.0, 90.0).round(4)
+        longitudes = ((city_longitudes[cities] + rng.normal(0.0, 0.5, size) + 180.0) % 360.0 - 180.0).round(4)
+        dates = np.datetime_as_string(rng.integers(FIRST_DAY, LAST_DAY + 1, size).astype('datetime64[D]'))
+        magnitudes = rng.uniform(0.0, 8.0, size).round(1)
+        rain_sums = rng.gamma(0.8, 6.0, size).round(1)
+        temperatures = (rng.normal(15.0, 10.0, size) - np.abs(latitudes) * 0.2).round(1)
+        no_city = rng.random(size) < MISSING_CITY_SHARE
+        no_rain = rng.random(size) < MISSING_RAIN_SHARE
+        no_temperature = rng.random(size) < MISSING_TEMPERATURE_SHARE
+
+        block = []
+        for i, (city, lat, lon, date, magnitude, rain, temperature) in enumerate(zip(
+                cities.tolist(), latitudes.tolist(), longitudes.tolist(), dates.tolist(),
+                magnitudes.tolist(), rain_sums.tolist(), temperatures.tolist())):
+            block.append({
+                'latitude': lat,
+                'longitude': lon,
+                'date': date,
+                'city': None if no_city[i] else city_values[city],
+                'magnitude': magnitude,
+                'weather': {
+                    'rain_sum': None if no_rain[i] else rain,
+                    'temperature_mean': None if no_temperature[i] else temperature,
+                },
+            })
+        yield block
+
+
+# Write n synthetic records to path as one JSON array (the merged_data layout), block by block
+def write_merged_data(path, n, seed=0, city_count=None):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write('[')
+        separator = '\n'
+        for block in generate_blocks(n, seed, city_count):
+            for record in block:
+                file.write(separator)
+                file.write(json.dumps(record))
+                separator = ',\n'
+        file.write('\n]\n')
+    os.replace(tmp_path, path)
+    return path
+
+
+# Path of the synthetic dataset for n records in folder, generated on first use
+def synthetic_dataset(folder, n, seed=0, city_count=None):
+    city_count = city_count or default_city_count(n)
+    path = os.path.join(folder, f'merged_data_{n}_{seed}_{city_count}.json')
+    if not os.path.exists(path):
+        write_merged_data(path, n, seed, city_count)
+    return path
+
+
+# Example Usage: python synthetic_data.py output.json records [seed]
+if __name__ == '__main__':
+    output_path = sys.argv[1] if len(sys.argv) > 1 else 'synthetic_merged_data.json'
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    write_merged_data(output_path, records, seed)
+    print(f"{records} synthetic records written to {output_path}")
@@ -1,98 +1,73 @@
 import os
-import shutil
-import json
 import folium
-from folium.plugins import HeatMap
-from collections import defaultdict
-import numpy as np
-from datetime import datetime
+from data_loader import iter_records, MAP_FIELDS
+from map_data import select_events
+from incremental_state import chunked_selection
+from city_stats import top_k
+from map_layers import add_heat_layer, save_map
+from profiling import profiled, report_saved, stage
+from render_cache import cached_render
 
-# Create a folder to save output
-def create_folder(folder_name):
-    if os.path.exists(folder_name):
-        shutil.rmtree(folder_name)  # Delete existing folder
-    os.makedirs(folder_name)  # Create a new folder
-
-# Load JSON data from the file
-def load_json(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
+# Stream records from the JSON file, keeping only the fields the maps read
+def load_json(file_path, fields=MAP_FIELDS):
+    return iter_records(file_path, fields=fields)
 
 # Function to generate a Temperature Variation Heatmap
-def generate_temperature_heatmap(json_data, output_folder='output_data', output_file='temperature_heatmap.html'):
-    # Ensure output folder exists
-    create_folder(output_folder)
+@profiled('temperature')
+def generate_temperature_heatmap(json_data, output_folder='output_data', output_file='temperature_heatmap.html', grid_size=None, tile_zooms=None, region=None, period=None,
+                                 hottest_cities=1, coldest_cities=1, rank_by='max', chunk_size=None, workers=None, precision=None, artifacts=None, kde=None, profile=None):
+    # Ensure output folder exists (without wiping it, other maps may be writing there)
+    os.makedirs(output_folder, exist_ok=True)
     output_path = os.path.join(output_folder, output_file)
     
-    # Extract data for heatmap and to find highest/lowest temperature cities
-    temperature_locations = []
-    city_temp_data = defaultdict(list)
-    highest_temp = -float('inf')
-    lowest_temp = float('inf')
-    highest_temp_city = ''
-    lowest_temp_city = ''
-    
-    for entry in json_data:
-        latitude = entry['latitude']
-        longitude = entry['longitude']
-        temperature_mean = entry['weather']['temperature_mean']
-        
-        # Ensure city_name is a string (not a list)
-        city_name = entry.get('city')
-        if isinstance(city_name, list):
-            city_name = ', '.join([str(c) for c in city_name if c])  # Join list elements into a string
-        
-        # Add temperature data for heatmap
-        temperature_locations.append((latitude, longitude, temperature_mean))
-        
-        # Collect temperature data by city
-        city_temp_data[city_name].append(temperature_mean)
-        
-        # Track highest and lowest temperature
-        if temperature_mean > highest_temp:
-            highest_temp = temperature_mean
-            highest_temp_city = city_name
-        
-        if temperature_mean < lowest_temp:
-            lowest_temp = temperature_mean
-            lowest_temp_city = city_name
-    
-    # Create map centered around the average latitude and longitude
-    avg_lat = np.mean([loc[0] for loc in temperature_locations])
-    avg_lon = np.mean([loc[1] for loc in temperature_locations])
-    m = folium.Map(location=[avg_lat, avg_lon], zoom_start=5)
+    # Aggregate temperature_mean per city in one pass (json_data can be an EventTable, records or an AggregateState)
+    # region limits the map to a (south, west, north, east) box or a (latitude, longitude, radius_km) circle
+    # chunk_size reads json_data (or a merged_data path) in batches of that many records, out of core;
+    # workers aggregates in that many processes
+    if chunk_size:
+        selection = chunked_selection(json_data, chunk_size, 'temperature_mean', weighted=True, region=region)
+    else:
+        selection = select_events(json_data, 'temperature_mean', weighted=True, region=region, workers=workers)
+    stats = selection.stats
+    city_names = stats.names(selection.city_names)
     
-    # Add heatmap layer for temperature mean
-    heat_data = [(lat, lon, temp) for lat, lon, temp in temperature_locations]
-    HeatMap(heat_data).add_to(m)
+    # Build the map: heat layer, markers and legend (timed as one stage when profiling)
+    with stage('build_map'):
+        # Create map centered around the average latitude and longitude
+        m = folium.Map(location=selection.center, zoom_start=5)
     
-    # Add markers for cities with highest and lowest temperature mean
-    # Highest temperature city - Red marker
-    highest_city_data = city_temp_data[highest_temp_city]
-    highest_city_lat = np.mean([entry['latitude'] for entry in json_data if entry['city'] == highest_temp_city])
-    highest_city_lon = np.mean([entry['longitude'] for entry in json_data if entry['city'] == highest_temp_city])
-    folium.Marker(
-        [highest_city_lat, highest_city_lon],
-        popup=f"City: {highest_temp_city}<br>Temperature: {highest_temp}°C",
-        icon=folium.Icon(color='red')
-    ).add_to(m)
+        # Add heatmap layer for temperature mean (binned when grid_size is set, pre-tiled when tile_zooms is set,
+        # one animation frame per day/week/month when period is set)
+        add_heat_layer(m, output_path, selection.latitudes, selection.longitudes, selection.weights, grid_size=grid_size, tile_zooms=tile_zooms,
+                       dates=selection.dates, period=period, kde=kde, kde_title='Mean temperature', kde_unit='°C', counts=selection.counts)
     
-    # Lowest temperature city - Blue marker
-    lowest_city_data = city_temp_data[lowest_temp_city]
-    lowest_city_lat = np.mean([entry['latitude'] for entry in json_data if entry['city'] == lowest_temp_city])
-    lowest_city_lon = np.mean([entry['longitude'] for entry in json_data if entry['city'] == lowest_temp_city])
-    folium.Marker(
-        [lowest_city_lat, lowest_city_lon],
-        popup=f"City: {lowest_temp_city}<br>Temperature: {lowest_temp}°C",
-        icon=folium.Icon(color='blue')
-    ).add_to(m)
+        # Add markers for the hottest cities (red) and the coldest cities (blue), placed at each city's mean location.
+        # rank_by='max' ranks cities by their highest/lowest temperature_mean, rank_by='mean' by their average.
+        if rank_by == 'mean':
+            hottest_values = coldest_values = stats.mean_value()
+        else:
+            hottest_values, coldest_values = stats.max_value, stats.min_value
+        mean_latitudes = stats.mean_latitude()
+        mean_longitudes = stats.mean_longitude()
+        for cities, values, color in (
+            (top_k(hottest_values, hottest_cities), hottest_values, 'red'),
+            (top_k(coldest_values, coldest_cities, largest=False), coldest_values, 'blue'),
+        ):
+            for index in cities.tolist():
+                folium.Marker(
+                    [mean_latitudes[index], mean_longitudes[index]],
+                    popup=f"City: {city_names[index]}<br>Temperature: {values[index]}°C",
+                    icon=folium.Icon(color=color)
+                ).add_to(m)
 
-    # Save the generated map
-    m.save(output_path)
-    print(f"Temperature heatmap saved as {output_path}")
+    # Save the generated map (precision rounds the streamed heat coordinates to that many decimals;
+    # artifacts packages it for offline serving, see save_map)
+    save_map(m, output_path, precision, artifacts)
+    report_saved(f"Temperature heatmap saved as {output_path}", output_path)
 
 # Example Usage
-data_file = 'heat_map\\merged_data.json'  # Ensure this JSON file exists
-create_folder('output_data')
-data = load_json(data_file)
-generate_temperature_heatmap(data)
+if __name__ == '__main__':
+    data_file = 'heat_map\\merged_data.json'  # Ensure this JSON file exists
+    # A rerun with the same data and options keeps the existing map (see render_cache)
+    output_path, status = cached_render(generate_temperature_heatmap, data_file)
+    print(f"{output_path}: {status}")
@@ -0,0 +1,164 @@
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from map_jobs import MAP_JOBS
+from event_table import as_table, days_to_dates, load_table
+from map_data import select_rows
+from grid_binning import heat_points
+
+# Supported time slices
+PERIODS = ('day', 'week', 'month')
+
+# Suffix of the file next to the period maps that records what each one was built from
+MANIFEST_SUFFIX = '_periods.json'
+
+
+# Period number of every day number, in one vectorized pass: the day itself, the Monday-based
+# week since the week of 1970-01-01 (a Thursday), or the month since 1970-01
+def period_keys(days, period):
+    days = np.asarray(days, dtype=np.int64)
+    if period == 'day':
+        return days
+    if period == 'week':
+        return (days + 3) // 7
+    if period == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f"period must be one of {PERIODS}, not {period!r}")
+
+
+# Display labels of period numbers: the day, the Monday that starts the week, or 'YYYY-MM'
+def period_labels(keys, period):
+    keys = np.asarray(keys, dtype=np.int64)
+    if period == 'week':
+        return days_to_dates(keys * 7 - 3).tolist()
+    if period == 'month':
+        return np.datetime_as_string(keys.astype('datetime64[M]'), unit='M').tolist()
+    return days_to_dates(keys).tolist()
+
+
+# Group row positions by period with one stable sort instead of a filter per period.
+# Returns the period numbers in ascending order and the rows of each (in their original order).
+def split_by_period(days, period):
+    keys = period_keys(days, period)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    if len(sorted_keys) == 0:
+        return sorted_keys, []
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return sorted_keys[starts], np.split(order, starts[1:])
+
+
+# Heat points of every period, as HeatMapWithTime expects them: (labels, one point list per period)
+def period_heat_data(latitudes, longitudes, dates, period, weights=None, grid_size=None):
+    latitudes = np.asarray(latitudes)
+    longitudes = np.asarray(longitudes)
+    weights = None if weights is None else np.asarray(weights)
+    keys, groups = split_by_period(dates, period)
+    data = [
+        heat_points(latitudes[rows], longitudes[rows], None if weights is None else weights[rows], grid_size)
+        for rows in groups
+    ]
+    return period_labels(keys, period), data
+
+
+# Fingerprint of one period's map: its rows, the names of its cities and the render options
+def _period_fingerprint(table, name, options):
+    digest = hashlib.sha256(json.dumps([name, repr(sorted(options.items()))]).encode())
+    for column in table.columns().values():
+        digest.update(np.ascontiguousarray(column).tobytes())
+    codes = np.unique(table.city)
+    digest.update(json.dumps([table.city_names[code] for code in codes[codes >= 0].tolist()]).encode())
+    return digest.hexdigest()
+
+
+def _load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def _save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+# Worker: render the map of one period's events
+def render_period(name, table, output_folder, output_file, options):
+    started = time.perf_counter()
+    module_name, function_name, _ = MAP_JOBS[name]
+    generate = getattr(importlib.import_module(module_name), function_name)
+    generate(table, output_folder=output_folder, output_file=output_file, **options)
+    return os.path.join(output_folder, output_file), time.perf_counter() - started
+
+
+# Render one map file per period (e.g. heatmap_2024-05.html) in parallel worker processes.
+# Only the events the map draws (e.g. its class) are split, so every period has a map to render.
+# A manifest next to the maps records a fingerprint of each period's input, so only periods
+# whose events or options changed since the last run are rendered again. When a period fails,
+# the manifest still records the ones that finished before the error is raised.
+# Returns {label: (path, seconds)} for the rebuilt periods and {label: (path, None)} for the reused ones.
+def render_periods(data, name, period, output_folder='period_output', workers=None, **options):
+    from event_maps import map_query  # event_maps imports this module (through map_layers)
+    table = as_table(data)
+    stem, extension = os.path.splitext(MAP_JOBS[name][2])
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, stem + MANIFEST_SUFFIX)
+    manifest = _load_manifest(manifest_path)
+
+    value_column, classes, class_label, _ = map_query(name)
+    selected = select_rows(table, value_column, classes, class_label)
+    keys, groups = split_by_period(table.date[selected], period)
+    results = {}
+    pending = {}
+    fingerprints = {}
+    for label, rows in zip(period_labels(keys, period), groups):
+        period_table = table.take(selected[rows])
+        output_file = f'{stem}_{label}{extension}'
+        fingerprints[label] = _period_fingerprint(period_table, name, options)
+        if manifest.get(label) == fingerprints[label] and os.path.exists(os.path.join(output_folder, output_file)):
+            results[label] = (os.path.join(output_folder, output_file), None)
+        else:
+            pending[label] = (period_table, output_file)
+
+    errors = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                label: executor.submit(render_period, name, period_table, output_folder, output_file, options)
+                for label, (period_table, output_file) in pending.items()
+            }
+            for label, future in futures.items():
+                try:
+                    results[label] = future.result()
+                except Exception as error:
+                    errors[label] = error
+                    continue
+                manifest[label] = fingerprints[label]
+
+    # Periods that no longer have events (or failed this time) are dropped from the manifest
+    finished = {label: manifest[label] for label in fingerprints if label in manifest and label not in errors}
+    _save_manifest(finished, manifest_path)
+    if errors:
+        label, error = next(iter(errors.items()))
+        raise RuntimeError(f"{len(errors)} of {len(fingerprints)} period maps failed ({', '.join(errors)}); {label}: {error}") from error
+    return {label: results[label] for label in fingerprints}
+
+
+# Example Usage: python time_slices.py path/to/merged_data.json [map] [period] [output_folder]
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else 'heat_map\\merged_data.json'
+    map_name = sys.argv[2] if len(sys.argv) > 2 else 'frequency'
+    period = sys.argv[3] if len(sys.argv) > 3 else 'month'
+    output_folder = sys.argv[4] if len(sys.argv) > 4 else 'period_output'
+    started = time.perf_counter()
+    results = render_periods(load_table(data_file), map_name, period, output_folder)
+    rebuilt = sum(seconds is not None for _, seconds in results.values())
+    print(f"{len(results)} {period} maps in {output_folder} ({rebuilt} rebuilt) in {time.perf_counter() - started:.1f}s")